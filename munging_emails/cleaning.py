@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+cleaning.py
+
+Contains the rules used to clean up lines of OCR'd text, compiled so each line is scanned as few times as possible.
+
+- LineCleaner: Marks redactions, fixes common OCR'ing mistakes, and collapses whitespace in a line.
+- REDACTION_CLEANER: The cleaner used when fixing files, only marks redactions.
+- OCR_CLEANER: The cleaner used when parsing contacts, only fixes OCR'ing mistakes.
+
+"""
+__author__ = 'alex'
+import re
+
+# The FOIA exemption codes printed where something was redacted.
+REDACTION_CODES = ["B6", "B5", "B4", "B3", "B2"]
+
+REDACTED_STRING = "(This info has been redacted)"
+
+# Characters that are commonly OCR'd in place of the ones in email addresses.
+OCR_REPLACEMENTS = {"›": ">", "‹": "<", "©": "@"}
+
+
+class LineCleaner(object):
+    __redaction_codes = []
+    __redacted_string = REDACTED_STRING
+    __replacements = {}
+    __collapse_whitespace = False
+
+    def __init__(self, redaction_codes=None, redacted_string=REDACTED_STRING, replacements=None,
+                 collapse_whitespace=False):
+        """
+        Cleans lines with a set of rules that are compiled into one regular expression. A line that none of the rules
+        apply to is only scanned once.
+
+        :param redaction_codes: A list of strings. If a line contains any, they are removed and every run of two or more spaces in that line is replaced with the redacted string. Codes are handled in the order given, so gaps left by removing one code are marked when the line has another.
+        :param redacted_string: The string that marks where something was redacted.
+        :param replacements: A dictionary of strings to replace, to what to replace them with. Ex. OCR_REPLACEMENTS.
+        :param collapse_whitespace: Boolean, if True runs of spaces are collapsed into one, in lines without redactions.
+        :return: None
+        """
+        self.__redaction_codes = list(redaction_codes or [])
+        self.__redacted_string = redacted_string
+        self.__replacements = dict(replacements or {})
+        self.__collapse_whitespace = collapse_whitespace
+        self._compile()
+
+    def get_redaction_codes(self):
+        """
+        Gets the redaction codes.
+
+        :return: The list of redaction codes.
+        """
+        return self.__redaction_codes[:]
+
+    def get_replacements(self):
+        """
+        Gets the replacements.
+
+        :return: The dictionary of strings to replace, to their replacement.
+        """
+        return dict(self.__replacements)
+
+    def get_key(self):
+        """
+        Gets every setting of the cleaner, to key caches of cleaned text by, so changing any setting cleans again.
+
+        :return: A list of strings.
+        """
+        return ["LineCleaner", repr(sorted(self.__redaction_codes)), repr(self.__redacted_string),
+                repr(sorted(self.__replacements.items())), str(self.__collapse_whitespace)]
+
+    def clean(self, line):
+        """
+        Cleans a single line.
+
+        :param line: The line to clean.
+        :return: The cleaned line.
+        """
+        if self.__trigger is None or not self.__trigger.search(line):
+            return line
+        codes = self.__codes.findall(line) if self.__codes is not None else []
+        if len(codes) > 1:
+            # Removing one code can leave a gap that the next code then marks, so these are done one code at a time.
+            return self._clean_codes_in_turn(line)
+        if codes:
+            return self.__pattern.sub(self.__replace_redacted, line)
+        return self.__pattern.sub(self.__replace, line)
+
+    def _clean_codes_in_turn(self, line):
+        """
+        Cleans a line with several redaction codes in it, marking the gaps and then removing each code in turn.
+
+        :param line: The line to clean.
+        :return: The cleaned line.
+        """
+        marker = " " + self.__redacted_string + " "
+        for code in self.__redaction_codes:
+            if code in line:
+                line = re.sub("  +", marker, line)
+                line = line.replace(code, "")
+        if self.__replacements:
+            line = self.__replacements_pattern.sub(self.__replace, line)
+        return line
+
+    def clean_lines(self, lines):
+        """
+        Cleans every line.
+
+        :param lines: An iterable of lines.
+        :return: A generator of the cleaned lines.
+        """
+        clean = self.clean
+        for line in lines:
+            yield clean(line)
+
+    def _compile(self):
+        """
+        Builds one pattern with a named group for each kind of rule, and a pattern of everything that can change a line.
+
+        :return: None
+        """
+        parts = []
+        triggers = []
+        self.__codes = None
+        self.__replacements_pattern = None
+        if self.__redaction_codes:
+            codes = "|".join(re.escape(code) for code in sorted(self.__redaction_codes, key=len, reverse=True))
+            self.__codes = re.compile(codes)
+            parts.append("(?P<code>" + codes + ")")
+            triggers.append(codes)
+        if self.__redaction_codes or self.__collapse_whitespace:
+            parts.append("(?P<gap>  +)")
+        if self.__collapse_whitespace:
+            triggers.append("  ")
+        if self.__replacements:
+            replacements = "|".join(re.escape(key) for key in sorted(self.__replacements, key=len, reverse=True))
+            parts.append("(?P<replace>" + replacements + ")")
+            triggers.append(replacements)
+            self.__replacements_pattern = re.compile("(?P<replace>" + replacements + ")")
+        self.__pattern = re.compile("|".join(parts)) if parts else None
+        self.__trigger = re.compile("|".join(triggers)) if triggers else None
+        marker = " " + self.__redacted_string + " "
+        replacements = self.__replacements
+        collapse = self.__collapse_whitespace
+
+        def replace(match):
+            group = match.lastgroup
+            if group == "replace":
+                return replacements[match.group()]
+            if group == "gap" and collapse:
+                return " "
+            return match.group()
+
+        def replace_redacted(match):
+            group = match.lastgroup
+            if group == "code":
+                return ""
+            if group == "gap":
+                return marker
+            return replacements[match.group()]
+
+        self.__replace = replace
+        self.__replace_redacted = replace_redacted
+
+
+REDACTION_CLEANER = LineCleaner(redaction_codes=REDACTION_CODES)
+
+OCR_CLEANER = LineCleaner(replacements=OCR_REPLACEMENTS)
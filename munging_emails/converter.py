@@ -0,0 +1,527 @@
+"""
+converter.py
+
+This file converts PDFs to text files with pdftotext, running several conversions at the same time.
+
+- Converter: A bounded pool of pdftotext processes with a timeout on each file. Large PDFs can be split into page ranges that are converted at the same time.
+- ConversionCache: Remembers which PDF content and pdftotext settings made each text file, and how it was fixed, so unchanged PDFs are skipped.
+
+"""
+__author__ = 'alex'
+import hashlib
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
+from cStringIO import StringIO
+from Queue import Queue, Empty
+from subprocess import Popen, PIPE
+
+
+class ConversionCache(object):
+    __cache_file = None
+    __save_every = 50
+
+    def __init__(self, cache_file, save_every=50):
+        """
+        A record of how every text file was made, stored as json. Each text file maps to a dictionary with all of the
+        keys pdf_sha1, flags, version, and fixed, the settings the text file was fixed with after it was converted, None
+        if it has not been fixed.
+
+        :param cache_file: Where the cache is stored, it is loaded if it already exists.
+        :param save_every: Int, how many updates to keep in memory before writing the cache to disk.
+        :return: None
+        """
+        self.__cache_file = cache_file
+        self.__save_every = save_every
+        self.__unsaved = 0
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        if os.path.exists(cache_file):
+            with open(cache_file, "r") as f:
+                self.__entries = json.load(f)
+
+    def get_cache_file(self):
+        """
+        Gets where the cache is stored.
+
+        :return: The location of the cache file.
+        """
+        return self.__cache_file
+
+    def is_current(self, txt_path, pdf_sha1, flags, version, fixed=None):
+        """
+        Checks if a text file exists and was made from the same PDF content with the same pdftotext and flags. A text
+        file that was fixed with other settings than fixed is not current, as it can not be fixed again.
+
+        :param txt_path: The text file to check.
+        :param pdf_sha1: The sha1 hex digest of the PDF.
+        :param flags: The list of flags pdftotext would be run with.
+        :param version: The version of pdftotext that would be run.
+        :param fixed: A list of strings describing the settings the text file will be fixed with, None if it will not be fixed.
+        :return: Boolean, True if the text file does not need to be made again.
+        """
+        with self.__lock:
+            entry = self.__entries.get(txt_path)
+        if entry is None or not os.path.exists(txt_path):
+            return False
+        if entry['fixed'] not in (None, fixed):
+            return False
+        return entry['pdf_sha1'] == pdf_sha1 and entry['flags'] == flags and entry['version'] == version
+
+    def needs_fixing(self, txt_path, fixed):
+        """
+        Checks if a text file in the cache has not been fixed with the given settings yet.
+
+        :param txt_path: The text file to check.
+        :param fixed: A list of strings describing the settings it will be fixed with.
+        :return: Boolean, True if the text file is in the cache and has not been fixed with these settings.
+        """
+        with self.__lock:
+            entry = self.__entries.get(txt_path)
+        return entry is not None and os.path.exists(txt_path) and entry['fixed'] != fixed
+
+    def set_fixed(self, txt_path, fixed):
+        """
+        Records that a text file in the cache was fixed, call it only after the fixed file is in place.
+
+        :param txt_path: The text file that was fixed.
+        :param fixed: A list of strings describing the settings it was fixed with.
+        :return: None
+        """
+        with self.__lock:
+            entry = self.__entries.get(txt_path)
+            if entry is not None:
+                entry['fixed'] = list(fixed)
+                self.__unsaved += 1
+                if self.__unsaved >= self.__save_every:
+                    self._write()
+
+    def set(self, txt_path, pdf_sha1, flags, version):
+        """
+        Records how a text file was made, saving the cache if enough updates have built up.
+
+        :param txt_path: The text file that was made.
+        :param pdf_sha1: The sha1 hex digest of the PDF it was made from.
+        :param flags: The list of flags pdftotext was run with.
+        :param version: The version of pdftotext that was run.
+        :return: None
+        """
+        with self.__lock:
+            self.__entries[txt_path] = {'pdf_sha1': pdf_sha1, 'flags': flags, 'version': version, 'fixed': None}
+            self.__unsaved += 1
+            if self.__unsaved >= self.__save_every:
+                self._write()
+
+    def remove(self, txt_path):
+        """
+        Forgets a text file, so it is made again next time.
+
+        :param txt_path: The text file to forget.
+        :return: None
+        """
+        with self.__lock:
+            if self.__entries.pop(txt_path, None) is not None:
+                self.__unsaved += 1
+
+    def save(self):
+        """
+        Writes the cache to disk.
+
+        :return: None
+        """
+        with self.__lock:
+            self._write()
+
+    def _write(self):
+        """
+        Writes the cache next to its location then moves it into place. Must be called while holding the lock.
+
+        :return: None
+        """
+        temp_file = self.__cache_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.__entries, f)
+        os.rename(temp_file, self.__cache_file)
+        self.__unsaved = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+class Converter(object):
+    __workers = 1
+    __timeout = None
+    __flags = ["-layout", "-enc", "UTF-8"]
+    __cache = None
+    __line_filter = None
+    __line_filter_key = None
+    __fix_key = None
+    __split_threshold = None
+    __pages_per_part = 100
+    __versions = {}
+
+    def __init__(self, workers=1, timeout=None, flags=None, cache=None, line_filter=None, line_filter_key=None,
+                 split_threshold=None, pages_per_part=100, fix_key=None):
+        """
+        Converts PDFs to text, keeping up to workers pdftotext processes running at once.
+
+        :param workers: Int, how many pdftotext processes to run at the same time.
+        :param timeout: Seconds a single file is allowed to take before its pdftotext is killed. None for no limit.
+        :param flags: The list of flags to pass to pdftotext. Default is ["-layout", "-enc", "UTF-8"].
+        :param cache: Optional ConversionCache. PDFs whose text file is already current in it are skipped.
+        :param line_filter: Optional function that takes an iterable of lines and yields the lines to keep. If given, pdftotext writes to a pipe and only the filtered lines are written to the text file.
+        :param line_filter_key: A list of strings describing the line filter's settings, stored in the cache with the flags so changing them converts again.
+        :param split_threshold: Optional int. PDFs with more pages than this are converted pages_per_part pages at a time, with the parts running at the same time. Needs pdfinfo.
+        :param pages_per_part: Int, how many pages of a large PDF each pdftotext converts.
+        :param fix_key: A list of strings describing the settings the text files are fixed with after they are converted, None if they are not. Text files in the cache that were fixed with other settings are converted again.
+        :return: None
+        """
+        if fix_key is not None:
+            self.__fix_key = list(fix_key)
+        self.__split_threshold = split_threshold
+        self.__pages_per_part = max(1, pages_per_part)
+        # Limits how many processes run at once, including the parts of large PDFs.
+        self.__slots = threading.Semaphore(max(1, workers))
+        self.__cache = cache
+        self.__line_filter = line_filter
+        if line_filter_key is not None:
+            self.__line_filter_key = list(line_filter_key)
+        self.__workers = max(1, workers)
+        self.__timeout = timeout
+        if flags is not None:
+            self.__flags = flags[:]
+
+    def get_workers(self):
+        """
+        Gets the number of pdftotext processes run at the same time.
+
+        :return: The number of workers.
+        """
+        return self.__workers
+
+    def get_cache(self):
+        """
+        Gets the ConversionCache.
+
+        :return: The ConversionCache, None if there is not one.
+        """
+        return self.__cache
+
+    def get_flags(self):
+        """
+        Gets the flags passed to pdftotext.
+
+        :return: The list of flags.
+        """
+        return self.__flags[:]
+
+    def get_version(self):
+        """
+        Gets the version line pdftotext prints, only asking pdftotext once.
+
+        :return: The version string, empty if pdftotext could not be run.
+        """
+        if "pdftotext" not in Converter.__versions:
+            try:
+                process = Popen(["pdftotext", "-v"], stdout=PIPE, stderr=PIPE)
+                out, err = process.communicate()
+                lines = (out + err).strip().splitlines()
+                Converter.__versions["pdftotext"] = lines[0].strip() if lines else ""
+            except OSError:
+                Converter.__versions["pdftotext"] = ""
+        return Converter.__versions["pdftotext"]
+
+    def convert(self, jobs, progress=None):
+        """
+        Converts every PDF to its text file.
+
+        :param jobs: A list of (pdf_path, txt_path) tuples.
+        :param progress: Optional function called with (done, total, pdf_path, error) after each file, error is None if it converted.
+        :return: A report with 'times', a dictionary of pdf to seconds taken, 'converted', the list of text files made, 'skipped', the list of PDFs whose text was current, 'failed', a dictionary of pdf to the reason it failed, and 'total_time'.
+        :rtype: dict
+        """
+        start = time.time()
+        report = {'times': {}, 'converted': [], 'skipped': [], 'failed': {}, 'total_time': 0.0}
+        queue = Queue()
+        for job in jobs:
+            queue.put(job)
+        total = len(jobs)
+        done = [0]
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                try:
+                    pdf_path, txt_path = queue.get_nowait()
+                except Empty:
+                    return
+                error = None
+                elapsed = None
+                try:
+                    elapsed = self.convert_one(pdf_path, txt_path)
+                except Exception as e:
+                    error = e
+                with lock:
+                    done[0] += 1
+                    if error is not None:
+                        report['failed'][pdf_path] = str(error)
+                    elif elapsed is None:
+                        report['skipped'].append(pdf_path)
+                    else:
+                        report['times'][pdf_path] = elapsed
+                        report['converted'].append(txt_path)
+                    if progress is not None:
+                        progress(done[0], total, pdf_path, error)
+
+        threads = [threading.Thread(target=work) for _ in xrange(min(self.__workers, total))]
+        try:
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.save_cache()
+        report['total_time'] = time.time() - start
+        return report
+
+    def convert_one(self, pdf_path, txt_path):
+        """
+        Converts a single PDF in the calling thread, unless the cache shows its text file is current. Call save_cache
+        when done, as this does not write the cache to disk.
+
+        :param pdf_path: The PDF to convert.
+        :param txt_path: Where to write the text.
+        :return: The seconds the conversion took, None if it was skipped.
+        """
+        if self.__cache is None:
+            return self._convert_file(pdf_path, txt_path)
+        version = self.get_version()
+        cache_flags = self.__flags[:]
+        if self.__line_filter is not None:
+            cache_flags += ["|"] + (self.__line_filter_key or [])
+        pdf_sha1 = self._hash_file(pdf_path)
+        if self.__cache.is_current(txt_path, pdf_sha1, cache_flags, version, self.__fix_key):
+            return None
+        self.__cache.remove(txt_path)
+        elapsed = self._convert_file(pdf_path, txt_path)
+        self.__cache.set(txt_path, pdf_sha1, cache_flags, version)
+        return elapsed
+
+    def save_cache(self):
+        """
+        Writes the conversion cache to disk, if there is one.
+
+        :return: None
+        """
+        if self.__cache is not None:
+            self.__cache.save()
+
+    def _hash_file(self, path):
+        """
+        Hashes a file without reading it all into memory.
+
+        :param path: The file to hash.
+        :return: The sha1 hex digest of the file.
+        """
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def convert_to_string(self, pdf_path):
+        """
+        Converts a single PDF straight to memory, running the line filter if there is one.
+
+        :param pdf_path: The PDF to convert.
+        :return: The text of the PDF.
+        :rtype: str
+        """
+        if self.__line_filter is None:
+            return self._run(["pdftotext"] + self.__flags + [pdf_path, "-"])
+        lines = []
+
+        def collect(stdout):
+            for line in self.__line_filter(stdout):
+                lines.append(line + "\n")
+
+        self._run(["pdftotext"] + self.__flags + [pdf_path, "-"], collect)
+        return "".join(lines)
+
+    def _convert_file(self, pdf_path, txt_path):
+        """
+        Converts a single PDF. With a line filter, the text is streamed from pdftotext through the filter and written
+        once, without an unfiltered copy ever touching the disk.
+
+        :param pdf_path: The PDF to convert.
+        :param txt_path: Where to write the text.
+        :return: The seconds the conversion took.
+        """
+        start = time.time()
+        pages = None
+        if self.__split_threshold is not None:
+            pages = self._count_pages(pdf_path)
+        try:
+            if pages is not None and pages > self.__split_threshold:
+                self._convert_in_parts(pdf_path, txt_path, pages)
+            elif self.__line_filter is None:
+                self._run(["pdftotext"] + self.__flags + [pdf_path, txt_path])
+            else:
+                part_path = txt_path + ".part"
+
+                def write_filtered(stdout):
+                    with open(part_path, "wb") as f:
+                        for line in self.__line_filter(stdout):
+                            f.write(line + "\n")
+
+                self._run(["pdftotext"] + self.__flags + [pdf_path, "-"], write_filtered)
+                os.rename(part_path, txt_path)
+        except Exception:
+            # Do not leave half a conversion behind to be fixed and parsed later.
+            for path in [txt_path, txt_path + ".part"]:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        return time.time() - start
+
+    def _count_pages(self, pdf_path):
+        """
+        Counts the pages in a PDF with pdfinfo.
+
+        :param pdf_path: The PDF to count.
+        :return: The number of pages, None if pdfinfo could not tell.
+        """
+        try:
+            out = self._run(["pdfinfo", pdf_path])
+        except (OSError, RuntimeError):
+            return None
+        for line in out.splitlines():
+            if line.startswith("Pages:"):
+                try:
+                    return int(line.split()[1])
+                except (IndexError, ValueError):
+                    return None
+        return None
+
+    def _convert_in_parts(self, pdf_path, txt_path, pages):
+        """
+        Converts a large PDF pages_per_part pages at a time, with the parts running at the same time, then joins the
+        parts back together in order. pdftotext ends every page with a form feed, so the joined text has the same page
+        breaks as converting the whole PDF at once.
+
+        :param pdf_path: The PDF to convert.
+        :param txt_path: Where to write the text.
+        :param pages: The number of pages in the PDF.
+        :return: None
+        """
+        ranges = [(first, min(first + self.__pages_per_part - 1, pages))
+                  for first in xrange(1, pages + 1, self.__pages_per_part)]
+        texts = [None] * len(ranges)
+        errors = []
+
+        def convert_part(idx):
+            first, last = ranges[idx]
+            try:
+                texts[idx] = self._run(["pdftotext"] + self.__flags + ["-f", str(first), "-l", str(last),
+                                                                       pdf_path, "-"])
+            except Exception as e:
+                errors.append(e)
+
+        # The slots keep the number of running processes at workers, however many parts are waiting.
+        threads = [threading.Thread(target=convert_part, args=(idx,)) for idx in xrange(1, len(ranges))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        convert_part(0)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        def joined_lines():
+            # Each part ends with a form feed that starts the first line of the next part.
+            carry = ""
+            for text in texts:
+                for line in StringIO(text):
+                    if carry:
+                        line = carry + line
+                        carry = ""
+                    if line.endswith("\n"):
+                        yield line
+                    else:
+                        carry = line
+            if carry:
+                yield carry
+
+        lines = joined_lines()
+        if self.__line_filter is not None:
+            lines = (line + "\n" for line in self.__line_filter(lines))
+        part_path = txt_path + ".part"
+        with open(part_path, "wb") as f:
+            for line in lines:
+                f.write(line)
+        os.rename(part_path, txt_path)
+
+    def _run(self, args, consume=None):
+        """
+        Runs a command, killing it if it takes longer than the timeout.
+
+        :param args: The command and its arguments.
+        :param consume: Optional function given the command's stdout as a file to read while it runs.
+        :return: What the command wrote to stdout, None if consume was given.
+        """
+        with self.__slots:
+            return self._run_process(args, consume)
+
+    def _run_process(self, args, consume):
+        """
+        Runs a command for _run, once it has a slot.
+
+        :param args: The command and its arguments.
+        :param consume: Optional function given the command's stdout as a file to read while it runs.
+        :return: What the command wrote to stdout, None if consume was given.
+        """
+        # Errors go to a file so a chatty pdftotext can never block on a full pipe.
+        err_file = tempfile.TemporaryFile()
+        # Started in its own process group so that a kill also reaches anything it spawned.
+        process = Popen(args, stdout=PIPE, stderr=err_file, preexec_fn=os.setsid)
+        timed_out = []
+
+        def kill():
+            timed_out.append(True)
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                # Already finished.
+                pass
+
+        timer = None
+        if self.__timeout is not None:
+            timer = threading.Timer(self.__timeout, kill)
+            timer.start()
+        out = None
+        try:
+            if consume is None:
+                out = process.stdout.read()
+            else:
+                consume(process.stdout)
+                # Drain anything the consumer did not read so the process can exit.
+                process.stdout.read()
+            process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            process.stdout.close()
+        if timed_out:
+            raise RuntimeError(args[0] + " took longer than " + str(self.__timeout) + " seconds")
+        if process.returncode != 0:
+            err_file.seek(0)
+            raise RuntimeError(args[0] + " exited with " + str(process.returncode) + ": " + err_file.read().strip())
+        return out
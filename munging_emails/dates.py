@@ -0,0 +1,158 @@
+"""
+dates.py
+
+Turns the OCR'd sent dates of emails into datetimes. Only a handful of formats recur, so the parser keeps the formats
+that worked most recently first, and remembers every string it has parsed.
+
+- DateParser: Parses sent dates, fixing common OCR'ing mistakes first.
+- DATE_PARSER: The parser used by Email.get_sent_datetime.
+- to_timestamp: Turns a datetime into seconds since the epoch.
+- bucket_start: Gets the start of the year, month, week, or day a datetime is in.
+
+"""
+__author__ = 'alex'
+import calendar
+import re
+import threading
+from datetime import datetime, timedelta
+
+# The formats dates are tried in, after commas, week days, and time zones are removed.
+DATE_FORMATS = ["%B %d %Y %I:%M %p", "%B %d %Y %I:%M:%S %p", "%B %d %Y %H:%M", "%B %d %Y %H:%M:%S", "%B %d %Y",
+                "%b %d %Y %I:%M %p", "%b %d %Y %I:%M:%S %p", "%b %d %Y %H:%M", "%b %d %Y %H:%M:%S", "%b %d %Y",
+                "%d %B %Y %H:%M:%S", "%d %B %Y %H:%M", "%d %B %Y", "%d %b %Y %H:%M:%S", "%d %b %Y %H:%M", "%d %b %Y",
+                "%m/%d/%Y %I:%M:%S %p", "%m/%d/%Y %I:%M %p", "%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M", "%m/%d/%Y",
+                "%m/%d/%y %I:%M %p", "%m/%d/%y %H:%M", "%m/%d/%y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d",
+                "%b %d %H:%M:%S %Y", "%B %d %Y %I %p", "%b %d %Y %I %p", "%m/%d/%Y %I %p", "%m/%d/%y %I %p"]
+
+# Runs of digits with letters commonly OCR'd in place of digits, like 2O15 or l0:3O.
+_OCR_NUMBER = re.compile(r"(?<![A-Za-z])[\dOolI|:/]*\d[\dOolI|:/]*(?![A-Za-z])")
+_OCR_DIGITS = {"O": "0", "o": "0", "l": "1", "I": "1", "|": "1"}
+# Words with digits commonly OCR'd in place of letters, like Apri1 or 0ct.
+_OCR_WORD = re.compile(r"\b(?=[A-Za-z01]*[A-Za-z]{2})[A-Za-z01]*[01][A-Za-z01]*\b")
+_OCR_LETTERS = {"0": "o", "1": "l"}
+_WEEK_DAY = re.compile(r"^(?:mon|tue|wed|thu|fri|sat|sun)[a-z]*\.?\s+", re.I)
+_TIME_ZONE = re.compile(r"\(?(?:GMT|UTC)[^)]*\)?|[+-]\d{4}\b|\b[ECMP][SD]T\b")
+# AM or PM written against the time, like 10AM or 1OPM, split off before OCR fixes read 10AM as a word.
+_GLUED_AM_PM = re.compile(r"(?<=[\dO])(?=[AaPp]\.?[Mm]\b)")
+_AM_PM = re.compile(r"(\d)\s*([ap])\.?\s?m\b\.?", re.I)
+_COLON = re.compile(r"(\d)\s*:\s*(\d)")
+_JUNK = re.compile(r",|\bat\b|\bSent:?\s|\bDate:?\s", re.I)
+_SEPT = re.compile(r"\bSept\b\.?", re.I)
+_MONTH_DOT = re.compile(r"\b([A-Za-z]{3})\.")
+_SPACES = re.compile(r"\s+")
+
+
+def to_timestamp(date):
+    """
+    Turns a datetime into seconds since the epoch. Sent dates have no time zone, so it is treated as UTC.
+
+    :param date: The datetime.
+    :return: Int, the seconds since the epoch.
+    """
+    return calendar.timegm(date.timetuple())
+
+
+def bucket_start(date, period):
+    """
+    Gets the start of the period a datetime is in.
+
+    :param date: The datetime.
+    :param period: "year", "month", "week" (starting on Monday), or "day".
+    :return: The datetime the period starts at.
+    """
+    if period == "year":
+        return datetime(date.year, 1, 1)
+    if period == "month":
+        return datetime(date.year, date.month, 1)
+    if period == "week":
+        return datetime(date.year, date.month, date.day) - timedelta(days=date.weekday())
+    if period == "day":
+        return datetime(date.year, date.month, date.day)
+    raise ValueError("period must be year, month, week, or day, not " + repr(period))
+
+
+class DateParser(object):
+    __max_size = 100000
+
+    def __init__(self, formats=None, max_size=100000):
+        """
+        Parses sent dates. A string is only parsed once, what it parsed to is kept in a table. Formats that work are
+        moved to the front, so the ones the corpus uses are tried first.
+
+        :param formats: A list of strptime formats, without commas or week days. Default is DATE_FORMATS.
+        :param max_size: Int, how many strings the table can hold before it is emptied, to bound its memory.
+        :return: None
+        """
+        if formats is None:
+            formats = DATE_FORMATS
+        self.__formats = list(formats)
+        self.__max_size = max(1, max_size)
+        self.__known = {}
+        self.__lock = threading.Lock()
+
+    def get_formats(self):
+        """
+        Gets the formats, in the order they are tried.
+
+        :return: The list of formats.
+        """
+        with self.__lock:
+            return self.__formats[:]
+
+    def parse(self, raw):
+        """
+        Parses a date.
+
+        :param raw: The date as it was OCR'd. Ex. "Monday, May 4, 2O15 l0:3O AM".
+        :return: The datetime, None if it could not be parsed.
+        """
+        if raw in self.__known:
+            return self.__known[raw]
+        date = self._parse(self.clean(raw))
+        if len(self.__known) >= self.__max_size:
+            self.__known = {}
+        self.__known[raw] = date
+        return date
+
+    def clean(self, raw):
+        """
+        Fixes the OCR'ing mistakes in a date, and removes what the formats do not have.
+
+        :param raw: The date as it was OCR'd.
+        :return: The cleaned date.
+        """
+        text = _GLUED_AM_PM.sub(" ", raw)
+        text = _OCR_WORD.sub(lambda match: "".join(_OCR_LETTERS.get(c, c) for c in match.group()), text)
+        text = _OCR_NUMBER.sub(lambda match: "".join(_OCR_DIGITS.get(c, c) for c in match.group()), text)
+        text = _TIME_ZONE.sub(" ", _JUNK.sub(" ", text))
+        text = _SEPT.sub("Sep", text)
+        text = _MONTH_DOT.sub(r"\1", text)
+        text = _COLON.sub(r"\1:\2", text)
+        text = _AM_PM.sub(lambda match: match.group(1) + " " + match.group(2).upper() + "M", text)
+        text = _SPACES.sub(" ", text).strip()
+        return _WEEK_DAY.sub("", text)
+
+    def _parse(self, text):
+        """
+        Tries every format, moving the one that works to the front.
+
+        :param text: The cleaned date.
+        :return: The datetime, None if no format works.
+        """
+        if not text:
+            return None
+        for idx, date_format in enumerate(self.get_formats()):
+            try:
+                date = datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+            if idx:
+                with self.__lock:
+                    if date_format in self.__formats:
+                        self.__formats.remove(date_format)
+                    self.__formats.insert(0, date_format)
+            return date
+        return None
+
+
+DATE_PARSER = DateParser()
@@ -0,0 +1,124 @@
+"""
+document_cache.py
+
+Keeps parsed documents on disk, so a document that has not changed since it was last parsed is not parsed again.
+
+- DocumentCache: A directory of parsed documents, one compressed file for each.
+
+"""
+__author__ = 'alex'
+import cPickle
+import errno
+import hashlib
+import os
+import tempfile
+import zlib
+
+
+class DocumentCache(object):
+    __cache_dir = None
+
+    def __init__(self, cache_dir):
+        """
+        A directory of parsed documents. Each one is stored in its own file, pickled and compressed, in a directory for
+        its location, and named after a key made from where the document is, its size, when it was modified, and the settings it was parsed with. A
+        document that changes, or is parsed with other settings, gets a new key, so an entry is never out of date. Only
+        the latest entry of each document is kept, storing a new key removes the others made from the same location.
+
+        :param cache_dir: The directory to keep the parsed documents in, it is created if it does not exist.
+        :return: None
+        """
+        self.__cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_cache_dir(self):
+        """
+        Gets the directory the parsed documents are kept in.
+
+        :return: The cache directory.
+        """
+        return self.__cache_dir
+
+    def make_key(self, path, settings):
+        """
+        Makes the key of a document from where it is, its size, when it was modified, and the parser settings. The key
+        starts with a hash of the location alone, so the entries of a document can be found when it gets a new key.
+
+        :param path: The location of the document.
+        :param settings: A list of strings, the settings the document is parsed with.
+        :return: The key, two hex strings joined by a dash.
+        """
+        stat = os.stat(path)
+        location = os.path.abspath(path)
+        parts = [location, str(stat.st_size), repr(stat.st_mtime)] + list(settings)
+        return hashlib.sha1(location).hexdigest() + "-" + hashlib.sha1("\0".join(parts)).hexdigest()
+
+    def get(self, key):
+        """
+        Gets a parsed document.
+
+        :param key: The key of the document.
+        :return: What was stored for the key, None if nothing was, or it could not be read.
+        """
+        try:
+            with open(self._path(key), "rb") as f:
+                return cPickle.loads(zlib.decompress(f.read()))
+        except (IOError, OSError, zlib.error, cPickle.UnpicklingError, EOFError, ValueError):
+            return None
+
+    def set(self, key, record):
+        """
+        Stores a parsed document, and removes the entries of the same document under other keys. The file is written
+        under another name first, so a reader never sees half of it.
+
+        :param key: The key of the document.
+        :param record: What to store, anything that can be pickled.
+        :return: None
+        """
+        data = zlib.compress(cPickle.dumps(record, 2))
+        entry_dir = os.path.dirname(self._path(key))
+        try:
+            os.makedirs(entry_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        handle, part_path = tempfile.mkstemp(suffix=".part", dir=entry_dir)
+        try:
+            with os.fdopen(handle, "wb") as f:
+                f.write(data)
+            os.rename(part_path, self._path(key))
+        except Exception:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        self._remove_old(key)
+
+    def _remove_old(self, key):
+        """
+        Removes the entries made from the same location as a key, other than the key itself.
+
+        :param key: The key that replaces them.
+        :return: None
+        """
+        path = self._path(key)
+        entry_dir = os.path.dirname(path)
+        for name in os.listdir(entry_dir):
+            old_path = os.path.join(entry_dir, name)
+            if old_path == path or not name.endswith(".doc"):
+                continue
+            try:
+                os.remove(old_path)
+            except OSError:
+                # Another worker removed it first.
+                pass
+
+    def _path(self, key):
+        """
+        Gets where a key is stored.
+
+        :param key: The key of the document.
+        :return: The location of its file, in the directory of the document's location.
+        """
+        location_hash, settings_hash = key.split("-")
+        return os.path.join(self.__cache_dir, location_hash, settings_hash + ".doc")
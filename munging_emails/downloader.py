@@ -0,0 +1,449 @@
+"""
+downloader.py
+
+This file downloads a list of links concurrently, reusing one connection per host for each worker.
+
+- Downloader: A pool of worker threads that stream links to disk, retrying failed links with backoff.
+- DownloadManifest: Remembers what has been downloaded so later runs only fetch new or partial files.
+- DownloadError: Raised when a link can not be downloaded.
+
+"""
+__author__ = 'alex'
+import hashlib
+import httplib
+import json
+import os
+import socket
+import threading
+import time
+import urlparse
+from Queue import Queue, Empty
+
+
+class DownloadError(Exception):
+    def __init__(self, message, retry=True):
+        """
+        An error raised while downloading a link.
+
+        :param message: The description of the error.
+        :param retry: Boolean, True if trying the link again could succeed.
+        :return: None
+        """
+        Exception.__init__(self, message)
+        self.retry = retry
+
+
+class DownloadManifest(object):
+    __manifest_file = None
+    __save_every = 50
+
+    def __init__(self, manifest_file, save_every=50):
+        """
+        A record of every link that has been downloaded, stored as json. Each link maps to a dictionary with the keys
+        path, size, etag, last_modified, sha1, and complete.
+
+        :param manifest_file: Where the manifest is stored, it is loaded if it already exists.
+        :param save_every: Int, how many updates to keep in memory before writing the manifest to disk.
+        :return: None
+        """
+        self.__manifest_file = manifest_file
+        self.__save_every = save_every
+        self.__unsaved = 0
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file, "r") as f:
+                self.__entries = json.load(f)
+
+    def get_manifest_file(self):
+        """
+        Gets where the manifest is stored.
+
+        :return: The location of the manifest file.
+        """
+        return self.__manifest_file
+
+    def get(self, url):
+        """
+        Gets a copy of the entry for a link.
+
+        :param url: The link to look up.
+        :return: The dictionary for the link, None if it has never been seen.
+        """
+        with self.__lock:
+            entry = self.__entries.get(url)
+            return dict(entry) if entry is not None else None
+
+    def set(self, url, entry):
+        """
+        Sets the entry for a link, saving the manifest if enough updates have built up.
+
+        :param url: The link to set.
+        :param entry: The dictionary describing the link.
+        :return: None
+        """
+        with self.__lock:
+            self.__entries[url] = dict(entry)
+            self.__unsaved += 1
+            if self.__unsaved >= self.__save_every:
+                self._write()
+
+    def is_complete(self, url, path):
+        """
+        Checks if a link was completely downloaded to path and the file is still there, untouched.
+
+        :param url: The link to check.
+        :param path: Where the file should be.
+        :return: Boolean, True if the link does not need to be downloaded again.
+        """
+        entry = self.get(url)
+        if entry is None or not entry.get('complete') or entry.get('path') != path:
+            return False
+        return os.path.exists(path) and os.path.getsize(path) == entry.get('size')
+
+    def save(self):
+        """
+        Writes the manifest to disk.
+
+        :return: None
+        """
+        with self.__lock:
+            self._write()
+
+    def _write(self):
+        """
+        Writes the manifest next to its location then moves it into place, so a crash never leaves half a manifest.
+        Must be called while holding the lock.
+
+        :return: None
+        """
+        temp_file = self.__manifest_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.__entries, f)
+        os.rename(temp_file, self.__manifest_file)
+        self.__unsaved = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+class Downloader(object):
+    __workers = 1
+    __retries = 3
+    __backoff = 1.0
+    __chunk_size = 64 * 1024
+    __timeout = 60
+    __max_redirects = 5
+    __manifest = None
+    __revalidate = False
+
+    def __init__(self, workers=1, retries=3, backoff=1.0, chunk_size=64 * 1024, timeout=60, manifest=None,
+                 revalidate=False):
+        """
+        Downloads links with a pool of worker threads. Every worker keeps a keep-alive connection open to each host
+        it has talked to, and writes the response to disk in chunks instead of holding it in memory.
+
+        :param workers: Int, how many links to download at the same time.
+        :param retries: Int, how many times to retry a link before giving up on it.
+        :param backoff: Float, seconds to wait before the first retry, doubled on every retry after.
+        :param chunk_size: Int, how many bytes to read from the connection at a time.
+        :param timeout: Int, seconds to wait on a connection before giving up on it.
+        :param manifest: Optional DownloadManifest. Complete files in it are skipped and partial files are resumed.
+        :param revalidate: Boolean, if True complete files are checked against the server and downloaded again if changed.
+        :return: None
+        """
+        self.__manifest = manifest
+        self.__revalidate = revalidate
+        self.__local = threading.local()
+        self.__workers = max(1, workers)
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__chunk_size = chunk_size
+        self.__timeout = timeout
+
+    def get_workers(self):
+        """
+        Gets the number of worker threads.
+
+        :return: The number of links downloaded at the same time.
+        """
+        return self.__workers
+
+    def get_manifest(self):
+        """
+        Gets the download manifest.
+
+        :return: The DownloadManifest, None if there is not one.
+        """
+        return self.__manifest
+
+    def download(self, jobs, progress=None, on_complete=None):
+        """
+        Downloads every link to its path, using the worker pool.
+
+        :param jobs: A list of (url, path) tuples.
+        :param progress: Optional function called with (done, total, url, error) after each link, error is None if it downloaded.
+        :param on_complete: Optional function called with (url, path) by the worker right after a link is downloaded or resumed. If it raises, the link is reported as failed.
+        :return: A report with the lists 'downloaded', 'resumed', 'unchanged', and 'skipped' of links, and 'failed', a dictionary of link to error.
+        :rtype: dict
+        """
+        report = {'downloaded': [], 'resumed': [], 'unchanged': [], 'skipped': [], 'failed': {}}
+        queue = Queue()
+        for url, path in jobs:
+            if self.__manifest is not None and not self.__revalidate and self.__manifest.is_complete(url, path):
+                report['skipped'].append(url)
+            else:
+                queue.put((url, path))
+        total = queue.qsize()
+        done = [0]
+        lock = threading.Lock()
+
+        def work():
+            connections = {}
+            try:
+                while True:
+                    try:
+                        url, path = queue.get_nowait()
+                    except Empty:
+                        return
+                    error = None
+                    try:
+                        outcome = self._fetch_with_retries(connections, url, path)
+                        if on_complete is not None and outcome != 'unchanged':
+                            on_complete(url, path)
+                    except Exception as e:
+                        error = e
+                    with lock:
+                        done[0] += 1
+                        if error is not None:
+                            report['failed'][url] = error
+                        else:
+                            report[outcome].append(url)
+                        if progress is not None:
+                            progress(done[0], total, url, error)
+            finally:
+                for connection in connections.values():
+                    connection.close()
+
+        threads = [threading.Thread(target=work) for _ in xrange(min(self.__workers, total))]
+        try:
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if self.__manifest is not None:
+                self.__manifest.save()
+        return report
+
+    def fetch(self, url, path):
+        """
+        Downloads a single link in the calling thread, reusing the connections that thread opened before. Call close
+        from the same thread when it is done downloading, and save the manifest when everything is done.
+
+        :param url: The link to download.
+        :param path: Where to write the file.
+        :return: 'downloaded', 'resumed', 'unchanged', or 'skipped' if the manifest shows it is already complete.
+        """
+        if self.__manifest is not None and not self.__revalidate and self.__manifest.is_complete(url, path):
+            return 'skipped'
+        connections = getattr(self.__local, 'connections', None)
+        if connections is None:
+            connections = self.__local.connections = {}
+        return self._fetch_with_retries(connections, url, path)
+
+    def close(self):
+        """
+        Closes the connections opened by fetch in the calling thread.
+
+        :return: None
+        """
+        connections = getattr(self.__local, 'connections', None)
+        if connections:
+            for connection in connections.values():
+                connection.close()
+            connections.clear()
+
+    def _fetch_with_retries(self, connections, url, path):
+        """
+        Downloads a link, waiting and trying again if it fails.
+
+        :param connections: The worker's dictionary of (scheme, host) to open connection.
+        :param url: The link to download.
+        :param path: Where to write the file.
+        :return: 'downloaded', 'resumed', or 'unchanged'.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._fetch(connections, url, path)
+            except (DownloadError, httplib.HTTPException, socket.error, IOError) as e:
+                # Whatever state the connection was left in can not be trusted anymore.
+                for connection in connections.values():
+                    connection.close()
+                connections.clear()
+                attempt += 1
+                if attempt > self.__retries or not getattr(e, 'retry', True):
+                    raise
+                time.sleep(self.__backoff * 2 ** (attempt - 1))
+
+    def _fetch(self, connections, url, path):
+        """
+        Downloads a link once, following redirects. Resumes a partial file, or asks the server if a complete file
+        changed, when the manifest has what is needed to do so.
+
+        :param connections: The worker's dictionary of (scheme, host) to open connection.
+        :param url: The link to download.
+        :param path: Where to write the file.
+        :return: 'downloaded', 'resumed', or 'unchanged'.
+        """
+        # Redirects change where the request goes, the manifest keeps the link it was given.
+        request_url = url
+        entry = None
+        if self.__manifest is not None:
+            entry = self.__manifest.get(url)
+        if entry is None or entry.get('path') != path:
+            entry = {'path': path, 'complete': False}
+        headers = {}
+        offset = 0
+        part_path = path + ".part"
+        validator = entry.get('etag') or entry.get('last_modified')
+        if not entry.get('complete') and validator and os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+            if offset:
+                headers['Range'] = "bytes=" + str(offset) + "-"
+                headers['If-Range'] = validator
+        elif entry.get('complete') and self.__revalidate and os.path.exists(path):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        for _ in xrange(self.__max_redirects + 1):
+            response = self._request(connections, request_url, headers)
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.getheader('location')
+                response.read()
+                if not location:
+                    raise DownloadError("Redirect without a location for " + request_url, False)
+                request_url = urlparse.urljoin(request_url, location)
+                continue
+            if response.status == 304 and ('If-None-Match' in headers or 'If-Modified-Since' in headers):
+                response.read()
+                return 'unchanged'
+            if response.status == 416:
+                # The partial file does not line up with the server's, start it over.
+                response.read()
+                os.remove(part_path)
+                raise DownloadError("Could not resume " + url, True)
+            resumed = response.status == 206 and offset > 0
+            if response.status != 200 and not resumed:
+                response.read()
+                # Client errors will not fix themselves, except for timeouts and rate limits.
+                retry = response.status >= 500 or response.status in (408, 429)
+                raise DownloadError("HTTP " + str(response.status) + " for " + url, retry)
+            if not resumed:
+                entry['etag'] = response.getheader('etag')
+                entry['last_modified'] = response.getheader('last-modified')
+            entry['complete'] = False
+            if self.__manifest is not None:
+                self.__manifest.set(url, entry)
+            entry['size'], entry['sha1'] = self._stream_to_file(response, path, resumed)
+            entry['complete'] = True
+            if self.__manifest is not None:
+                self.__manifest.set(url, entry)
+            if resumed:
+                return 'resumed'
+            return 'downloaded'
+        raise DownloadError("Too many redirects for " + url, False)
+
+    def _request(self, connections, url, headers):
+        """
+        Sends a GET request over the worker's connection to the host, opening one if needed.
+
+        :param connections: The worker's dictionary of (scheme, host) to open connection.
+        :param url: The link to request.
+        :param headers: A dictionary of extra headers to send.
+        :return: The response, which must be read fully before the connection is used again.
+        """
+        parts = urlparse.urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        selector = parts.path or "/"
+        if parts.query:
+            selector += "?" + parts.query
+        connection = connections.get(host)
+        if connection is None:
+            if parts.scheme == "https":
+                connection = httplib.HTTPSConnection(parts.netloc, timeout=self.__timeout)
+            else:
+                connection = httplib.HTTPConnection(parts.netloc, timeout=self.__timeout)
+            connections[host] = connection
+            connection.request("GET", selector, headers=headers)
+            return connection.getresponse()
+        try:
+            connection.request("GET", selector, headers=headers)
+            return connection.getresponse()
+        except (httplib.HTTPException, socket.error):
+            # The server closed the idle connection, open a new one and try once more.
+            connection.close()
+            connection.request("GET", selector, headers=headers)
+            return connection.getresponse()
+
+    def _expected_size(self, response):
+        """
+        Gets how large the whole file should be from the response headers. httplib does not raise an error when the
+        connection closes early, so this is how a cut off download is caught.
+
+        :param response: The response, a 200 or a 206.
+        :return: The size of the whole file in bytes, None if the server did not say.
+        """
+        if response.status == 206:
+            # Content-Range looks like "bytes 500-999/1000", the total can be "*" if the server does not know it.
+            byte_range, _, total = (response.getheader('content-range') or "").partition("/")
+            if total.strip().isdigit():
+                return int(total)
+            end = byte_range.rpartition("-")[2].strip()
+            if end.isdigit():
+                return int(end) + 1
+            return None
+        length = response.getheader('content-length')
+        if length is not None and length.strip().isdigit():
+            return int(length)
+        return None
+
+    def _stream_to_file(self, response, path, append=False):
+        """
+        Writes the response to disk in chunks. The file only appears at path once it has been written completely. If
+        the server closes the connection before sending every byte it said it would, the partial file is left to be
+        resumed and a DownloadError is raised.
+
+        :param response: The response to read.
+        :param path: Where to write the file.
+        :param append: Boolean, True to add to the partial file already on disk instead of starting over.
+        :return: A tuple of the size and the sha1 hex digest of the whole file.
+        """
+        part_path = path + ".part"
+        sha1 = hashlib.sha1()
+        size = 0
+        if append:
+            with open(part_path, "rb") as f:
+                while True:
+                    chunk = f.read(self.__chunk_size)
+                    if not chunk:
+                        break
+                    sha1.update(chunk)
+                    size += len(chunk)
+        with open(part_path, "ab" if append else "wb") as f:
+            while True:
+                chunk = response.read(self.__chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                sha1.update(chunk)
+                size += len(chunk)
+        expected = self._expected_size(response)
+        if expected is not None and size != expected:
+            raise DownloadError("Only got " + str(size) + " of " + str(expected) + " bytes for " + path, True)
+        os.rename(part_path, path)
+        return size, sha1.hexdigest()
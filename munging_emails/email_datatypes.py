@@ -1,64 +1,281 @@
 """
 This file contains all of the different datatypes todo with EmailMunging.
 
+- LineBuffer: The lines of a document kept as one string and the offsets where they start.
+- LineSpan: A read only view of some of the lines of a document, without copying them.
 - Email: An email object that should be initialized with a list of lines.
 - Document: A Document object that represents many emails, is iterable.
-- Collection: An object that represents many documents, is also iterable.
+- Collection: An object that represents many documents, is also iterable. Slicing, filtering, or taking a subset of one
+  gives a new Collection, and documents can be looked up by their ID.
 
 """
 __author__ = 'alex'
-from fuzzywuzzy import fuzz
-from profile import Contact
+from dates import DATE_PARSER, bucket_start
+from headers import HEADER_CLASSIFIER
+from profile import CONTACT_CACHE
 import re
+import copy
 import glob
+import mmap
 import os
-import boto
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from multiprocessing import Pool
+from s3_transfer import S3Transfer, connect_s3
+from sharding import shard_of
+
+_NEWLINE = re.compile('\n')
+# The whitespace str.strip() removes, other than newlines.
+_STRIPPED = ' \t\r\x0b\x0c'
+# Whitespace at the end of a line and the start of the next.
+_LINE_EDGES = re.compile('[' + _STRIPPED + ']*\n[' + _STRIPPED + ']*')
+# Runs of spaces in the lines of a document.
+_MULTI_SPACE = re.compile(' {2,}')
+# Lines with from, or sent (or date) in their first 6 characters.
+_FROM_LINE = re.compile('^[^\n]{0,2}(?:from|prom)', re.I | re.M)
+_SENT_LINE = re.compile('^[^\n]{0,2}(?:date|sent)', re.I | re.M)
+
+# Change when the parsing changes, so documents cached by the old parser are parsed again.
+PARSER_VERSION = 1
+
+
+def clean_lines(data):
+    """
+    Strips every line of a document and replaces runs of spaces in it with one, a few passes over the whole document
+    instead of one for each line.
+
+    :param data: The contents of the document, a string or mmap.
+    :return: The cleaned string, with the same number of lines.
+    """
+    cleaned = _LINE_EDGES.sub('\n', data)
+    cleaned = _MULTI_SPACE.sub(' ', cleaned).strip(_STRIPPED)
+    # End the last line with a newline too, so it is not lost if it was only whitespace.
+    if len(data) and data[len(data) - 1] != '\n':
+        cleaned += '\n'
+    return cleaned
+
+
+class LineBuffer(object):
+    __slots__ = ('__data', '__offsets')
+
+    def __init__(self, data, offsets=None):
+        """
+        The lines of a document, kept as the one string (or mmap) they are in and an array of where each line starts. A
+        line only becomes its own string when it is asked for.
+
+        :param data: The contents of the document, a string or mmap. Lines end with "\n".
+        :param offsets: Optional array of where each line starts, from get_offsets, so they are not found again.
+        :return: None
+        """
+        self.__data = data
+        if offsets is not None:
+            self.__offsets = offsets
+            return
+        offsets = array('l')
+        if len(data):
+            offsets.append(0)
+            offsets.extend(match.end() for match in _NEWLINE.finditer(data))
+            # Nothing starts after a newline at the very end.
+            if offsets[-1] == len(data):
+                offsets.pop()
+        self.__offsets = offsets
+
+    def get_data(self):
+        """
+        Gets the contents of the document.
+
+        :return: The string or mmap the lines are in.
+        """
+        return self.__data
+
+    def get_offsets(self):
+        """
+        Gets where each line starts.
+
+        :return: The array of offsets.
+        """
+        return self.__offsets
+
+    def line_of(self, position):
+        """
+        Gets the line a position in the contents is on.
+
+        :param position: Int, the position in the contents.
+        :return: The index of the line.
+        """
+        return bisect_right(self.__offsets, position) - 1
+
+    def __len__(self):
+        return len(self.__offsets)
+
+    def __getitem__(self, item):
+        if item < 0:
+            item += len(self.__offsets)
+        if not 0 <= item < len(self.__offsets):
+            raise IndexError("line index out of range")
+        if item + 1 < len(self.__offsets):
+            end = self.__offsets[item + 1] - 1
+        else:
+            end = len(self.__data)
+            if end and self.__data[end - 1] == '\n':
+                end -= 1
+        return self.__data[self.__offsets[item]:end]
+
+    def __iter__(self):
+        for idx in xrange(len(self.__offsets)):
+            yield self[idx]
 
 
-class Email:
-    __email_dict = {}
-    __has_field = {}
-    __previous_replies = []
-    __list_of_lines = []
+class LineSpan(object):
+    __slots__ = ('__lines', '__start', '__end')
+
+    def __init__(self, lines, start=0, end=None):
+        """
+        A read only view of lines[start:end]. Every email of a document is a span of the same list of lines, so a thread
+        of replies does not copy the rest of the document for each reply.
+
+        :param lines: The list of lines, or LineBuffer, to view.
+        :param start: Int, the index of the first line.
+        :param end: Int, the index after the last line. Default is the end of lines.
+        :return: None
+        """
+        if end is None:
+            end = len(lines)
+        self.__lines = lines
+        self.__start = start
+        self.__end = max(start, end)
+
+    def get_start(self):
+        """
+        Gets where the span starts in the lines it views.
 
-    def __init__(self, list_of_lines):
+        :return: The index of the first line.
         """
-        Converts an email (represented by a list of lines) into a python dictionary object with fields.
+        return self.__start
+
+    def get_end(self):
+        """
+        Gets where the span ends in the lines it views.
+
+        :return: The index after the last line.
+        """
+        return self.__end
+
+    def __len__(self):
+        return self.__end - self.__start
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, end, step = item.indices(len(self))
+            if step != 1:
+                return [self[idx] for idx in xrange(start, end, step)]
+            return LineSpan(self.__lines, self.__start + start, self.__start + end)
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("line index out of range")
+        return self.__lines[self.__start + item]
+
+    def __iter__(self):
+        lines = self.__lines
+        for idx in xrange(self.__start, self.__end):
+            yield lines[idx]
+
+
+class Email(object):
+    # Emails are created for every email of every document, slots keep each one small.
+    __slots__ = ('__list_of_lines', '__header_region_only', '__email_dict', '__has_field', '__field_lines', '__body',
+                 '__previous_replies')
+    # The order of the fields in the record of a parsed email.
+    _FIELDS = ('From', 'To', 'Sent', 'Subject', 'CC', 'Attachments')
+
+    def __init__(self, list_of_lines, header_region_only=False):
+        """
+        Represents an email (a list of lines) with the fields: From, To, Sent, Subject, CC, Attachments, and Body. The
+        fields are only parsed the first time one is asked for, and the body is only joined the first time get_body is
+        called, so reading just the contacts of an email skips building its body.
 
         :param list_of_lines: The individual li to convert to a python dictionary in the form of a list of lines.
-        :return: The dictionary object that represents an email with the fields: From, To, Sent, Subject, CC, Attachments, and Body
+        :param header_region_only: Boolean, if True fields are only looked for in the header at the top of the email, which ends at the first line that is not a field. The rest of the email is the body.
+        :return: None
         """
         # Can create an email object from an email object.
-        if type(self) is type(list_of_lines):
+        if isinstance(list_of_lines, Email):
             self.__list_of_lines = list_of_lines.get_raw()
+        # Spans can not change, so they do not need to be copied.
+        elif isinstance(list_of_lines, LineSpan):
+            self.__list_of_lines = list_of_lines
         else:
             self.__list_of_lines = list_of_lines[:]
+        self.__header_region_only = header_region_only
+        self.__email_dict = None
+        self.__has_field = None
+        self.__field_lines = None
+        self.__body = None
+        self.__previous_replies = []
+
+    def _parse(self):
+        """
+        Parses the fields of the email, and finds which lines are fields, if it has not been done yet.
 
+        :return: The dictionary of the fields From, To, Sent, Subject, CC, and Attachments.
+        """
+        if self.__email_dict is not None:
+            return self.__email_dict
+        lines = self.__list_of_lines
         to_convert = {'From': "", 'To': "", 'Sent': "", 'Subject': "", 'CC': "", 'Attachments': ""}
         has_field = {'From': False, 'To': False, 'Sent': False, 'Subject': False, 'CC': False, 'Attachments': False}
-        body = ""
-        for line in self.__list_of_lines:
+        field_lines = []
+        for idx, line in enumerate(lines):
             line_in_dic = False
             broken_by_spaces = line.split(" ")
             # If it's not empty
             if broken_by_spaces:
-                # Go through every field to find.
-                for key in to_convert:
-                    # If the first word is similar enough to the key, and the key has not already been found,
-                    # then add the rest of the line to that field in to_convert.
-                    if fuzz.ratio(key.lower(), broken_by_spaces[0].lower()) > 50 and to_convert[key] == '':
+                # Go through every field the first word is similar enough to.
+                for key in HEADER_CLASSIFIER.classify(broken_by_spaces[0]):
+                    # If the key has not already been found, then add the rest of the line to that field in to_convert.
+                    if to_convert[key] == '':
                         for x in xrange(1, len(broken_by_spaces)):
                             to_convert[key] += broken_by_spaces[x]
                             has_field[key] = True
                             if x != len(broken_by_spaces) - 1:
                                 to_convert[key] += " "
                         line_in_dic = True
-            # If it is not part of the header, then it must be part of the body.
-            if not line_in_dic:
-                body += (line + "\n")
-        to_convert['Body'] = body
+            # Lines that are not part of the header are part of the body.
+            if line_in_dic:
+                field_lines.append(idx)
+            # The header is over, so the rest of the lines are all body.
+            elif self.__header_region_only:
+                break
+        self.__field_lines = field_lines
         self.__has_field = has_field
         self.__email_dict = to_convert
+        return to_convert
+
+    def _get_parsed(self):
+        """
+        Gets a record of the parsed fields, that _set_parsed can restore without parsing the email again.
+
+        :return: A tuple of the field values and if each field was found, in the order of _FIELDS, and the indexes of the lines that are fields.
+        """
+        to_convert = self._parse()
+        return (tuple(to_convert[key] for key in self._FIELDS), tuple(self.__has_field[key] for key in self._FIELDS),
+                tuple(self.__field_lines))
+
+    def _set_parsed(self, record):
+        """
+        Restores the parsed fields from a record made by _get_parsed.
+
+        :param record: The record of the parsed fields.
+        :return: None
+        """
+        values, found, field_lines = record
+        self.__email_dict = dict(zip(self._FIELDS, values))
+        self.__has_field = dict(zip(self._FIELDS, found))
+        self.__field_lines = list(field_lines)
 
     def is_email(self):
         """
@@ -66,7 +283,7 @@ class Email:
 
         :return: The boolean representing if it is an email or not.
         """
-        return sum([self.get_body() != '', self.get_from() != '', self.get_to() != '', self.get_sent() != '',
+        return sum([self.has_body(), self.get_from() != '', self.get_to() != '', self.get_sent() != '',
                     self.get_subject() != '']) >= 2
 
     def set_previous_replies(self, lines):
@@ -80,9 +297,10 @@ class Email:
 
     def get_previous_replies(self):
         """
-        Gets the previous replies in a thread.
+        Gets the previous replies in a thread. For a forward or reply in a Document, these are the lines of the emails
+        after it, which it quotes.
 
-        :return: The list of lines representing the previous replies.
+        :return: The list (or LineSpan) of lines representing the previous replies, empty if there are none.
         """
         return self.__previous_replies
 
@@ -100,7 +318,7 @@ class Email:
 
         :return: The from field of the email.
         """
-        return self.__email_dict['From']
+        return self._parse()['From']
 
     def get_to(self):
         """
@@ -108,7 +326,7 @@ class Email:
 
         :return: The to field of the email.
         """
-        return self.__email_dict['To']
+        return self._parse()['To']
 
     def get_sent(self):
         """
@@ -116,7 +334,15 @@ class Email:
 
         :return: The sent or date field of the email.
         """
-        return self.__email_dict['Sent']
+        return self._parse()['Sent']
+
+    def get_sent_datetime(self):
+        """
+        Gets the sent field of the email as a datetime, with common OCR'ing mistakes fixed. See dates.DateParser.
+
+        :return: The datetime the email was sent, None if the sent field could not be parsed.
+        """
+        return DATE_PARSER.parse(self.get_sent())
 
     def get_subject(self):
         """
@@ -124,7 +350,7 @@ class Email:
 
         :return: The subject field of the email.
         """
-        return self.__email_dict['Subject']
+        return self._parse()['Subject']
 
     def get_cc(self):
         """
@@ -132,7 +358,7 @@ class Email:
 
         :return: The CC field of the email.
         """
-        return self.__email_dict['CC']
+        return self._parse()['CC']
 
     def get_attachments(self):
         """
@@ -140,7 +366,7 @@ class Email:
 
         :return: The name(s) of the attachments.
         """
-        return self.__email_dict['Attachments']
+        return self._parse()['Attachments']
 
     def get_body(self):
         """
@@ -148,7 +374,24 @@ class Email:
 
         :return: The body of the email.
         """
-        return self.__email_dict['Body']
+        if self.__body is None:
+            self._parse()
+            field_lines = set(self.__field_lines)
+            self.__body = "".join(line + "\n" for idx, line in enumerate(self.__list_of_lines) if idx not in field_lines)
+        return self.__body
+
+    def get_body_line(self):
+        """
+        Gets where the body starts, the first line of the email that is not a field.
+
+        :return: The index of the line in the email, the number of lines if it is all fields.
+        """
+        self._parse()
+        field_lines = set(self.__field_lines)
+        for idx in xrange(len(self.__list_of_lines)):
+            if idx not in field_lines:
+                return idx
+        return len(self.__list_of_lines)
 
     def has_from(self):
         """
@@ -156,6 +399,7 @@ class Email:
 
         :return: The from field of the email.
         """
+        self._parse()
         return self.__has_field['From']
 
     def has_to(self):
@@ -164,6 +408,7 @@ class Email:
 
         :return: The to field of the email.
         """
+        self._parse()
         return self.__has_field['To']
 
     def has_sent(self):
@@ -172,6 +417,7 @@ class Email:
 
         :return: The sent or date field of the email.
         """
+        self._parse()
         return self.__has_field['Sent']
 
     def has_subject(self):
@@ -180,6 +426,7 @@ class Email:
 
         :return: The subject field of the email.
         """
+        self._parse()
         return self.__has_field['Subject']
 
     def has_cc(self):
@@ -188,6 +435,7 @@ class Email:
 
         :return: The CC field of the email.
         """
+        self._parse()
         return self.__has_field['CC']
 
     def has_attachments(self):
@@ -196,15 +444,17 @@ class Email:
 
         :return: The name(s) of the attachments.
         """
+        self._parse()
         return self.__has_field['Attachments']
 
     def has_body(self):
         """
         Has the body of the email.
 
-        :return: The body of the email.
+        :return: Boolean, True if the email has any lines that are not fields.
         """
-        return self.__has_field['Body']
+        self._parse()
+        return len(self.__list_of_lines) > len(self.__field_lines)
 
 
 class Document:
@@ -212,22 +462,74 @@ class Document:
     __id = None
     __link = None
     __use_threads = True
-    __document_lines = []
+    __lines = []
     __doc_should_be_checked = False
+    __header_region_only = False
+    __email_objects = None
 
-    def __init__(self, document_lines, use_threads, doc_id):
+    def __init__(self, document_lines, use_threads, doc_id, header_region_only=False, parsed=None):
         """
         Creates a document, representing a thread of emails (FW or RE).
 
-        :param document_lines: The lines of the file.
+        :param document_lines: The lines of the file, or its contents as one string or mmap. The mmap can be closed once the Document is created.
         :param use_threads: Boolean if to break emails up into threads or not.
         :param doc_id: String, the id of the document.
+        :param header_region_only: Boolean, if True each email's fields are only looked for in its header. See Email.
+        :param parsed: Optional record from get_parsed to restore instead of parsing, then document_lines is not used.
         :return: None
         """
         self.__id = doc_id
         self.__use_threads = use_threads
-        self.__document_lines = document_lines
-        self.__emails = self._break_into_emails()
+        self.__header_region_only = header_region_only
+        if parsed is not None:
+            self._set_parsed(parsed)
+            return
+        self.__emails, self.__previous_replies = self._break_into_emails(document_lines)
+        self.__email_objects = None
+
+    def get_parsed(self):
+        """
+        Gets a record of the parsed document and the fields of its emails, that can be stored and given back to
+        Document to skip parsing it again.
+
+        :return: A tuple of the cleaned text, the line offsets, the (start, end, replies_start) span of each email, if the document should be checked, and the parsed fields of each email.
+        """
+        spans = []
+        for span, previous_replies in zip(self.__emails, self.__previous_replies):
+            if not isinstance(span, LineSpan):
+                raise ValueError("Emails added with add_email can not be recorded.")
+            spans.append((span.get_start(), span.get_end(),
+                          None if previous_replies is None else previous_replies.get_start()))
+        return (self.__lines.get_data(), self.__lines.get_offsets().tostring(), spans, self.__doc_should_be_checked,
+                [email._get_parsed() for email in self])
+
+    def _set_parsed(self, parsed):
+        """
+        Restores a document from a record made by get_parsed.
+
+        :param parsed: The record of the parsed document.
+        :return: None
+        """
+        text, offsets, spans, doc_should_be_checked, email_records = parsed
+        line_offsets = array('l')
+        line_offsets.fromstring(offsets)
+        self.__lines = LineBuffer(text, line_offsets)
+        self.__doc_should_be_checked = doc_should_be_checked
+        self.__emails = []
+        self.__previous_replies = []
+        self.__email_objects = []
+        for (start, end, replies_start), email_record in zip(spans, email_records):
+            span = LineSpan(self.__lines, start, end)
+            email = Email(span, self.__header_region_only)
+            email._set_parsed(email_record)
+            if replies_start is None:
+                previous_replies = None
+            else:
+                previous_replies = LineSpan(self.__lines, replies_start, end)
+                email.set_previous_replies(previous_replies)
+            self.__emails.append(span)
+            self.__previous_replies.append(previous_replies)
+            self.__email_objects.append(email)
 
     def get_pdf_link(self):
         """
@@ -274,25 +576,23 @@ class Document:
             return True
         # Load all contacts in document
         contacts_in_doc = []
-        for email in self.__emails:
-            # Create an email object from the list of lines.
-            email = Email(email)
+        for email in self:
             contacts_list = [email.get_from()]
 
             # Add each from contact.
-            contacts_in_doc.append(Contact(email.get_from(), "(This info has been redacted)"))
+            contacts_in_doc.append(CONTACT_CACHE.get(email.get_from(), "(This info has been redacted)"))
             # Checks to see if there is a "to:" field.
             if email.has_to():
                 # Gets the first "to:" field if there are multiple.
-                contacts_in_doc.append(Contact(email.get_to().split(";")[0], "(This info has been redacted)"))
+                contacts_in_doc.append(CONTACT_CACHE.get(email.get_to().split(";")[0], "(This info has been redacted)"))
                 contacts_list.append(email.get_to())
             # Checks to see if there is a "CC:" field.
             if email.has_cc():
                 # Gets the first "CC:" field if there are multiple.
-                contacts_in_doc.append(Contact(email.get_cc().split(";")[0], "(This info has been redacted)"))
+                contacts_in_doc.append(CONTACT_CACHE.get(email.get_cc().split(";")[0], "(This info has been redacted)"))
                 contacts_list.append(email.get_cc())
             contacts_list = [email.get_from(), email.get_to().split(";")[0], email.get_cc().split(";")[0]]
-            for c in [Contact(con, "(This info has been redacted)") for con in contacts_list]:
+            for c in [CONTACT_CACHE.get(con, "(This info has been redacted)") for con in contacts_list]:
                 if c.is_mangled():
                     return True
 
@@ -313,6 +613,8 @@ class Document:
         :return: None.
         """
         self.__emails.append(email)
+        self.__previous_replies.append(None)
+        self.__email_objects = None
 
     def __len__(self):
         """
@@ -324,140 +626,132 @@ class Document:
 
     def __iter__(self):
         """
-        The iterable interface: return an iterator from __iter__().
+        The iterable interface: return an iterator from __iter__(). The Email objects are only created once, so
+        iterating again reuses the fields they already parsed.
         """
-        for email in self.__emails:
-            yield Email(email)
+        if self.__email_objects is None:
+            email_objects = []
+            for email_lines, previous_replies in zip(self.__emails, self.__previous_replies):
+                email = Email(email_lines, self.__header_region_only)
+                if previous_replies is not None:
+                    email.set_previous_replies(previous_replies)
+                email_objects.append(email)
+            self.__email_objects = email_objects
+        return iter(self.__email_objects)
 
-    def _break_into_emails(self):
+    def _break_into_emails(self, document_lines):
         """
         Turn a document, preferably a list of lines that has already been run through the fix_file method, into a list of emails.
+        The lines are stripped and have their spaces cleaned up once, into one string, and every email is a span of them.
 
-        :return: A list of lists of strings, each entry in the first list represents a list of lines each representing an email.
+        :param document_lines: The lines of the file, or its contents as one string or mmap.
+        :return: A tuple of two lists. The LineSpan of each email, and the LineSpan of the previous replies quoted by each email, None if it is not a forward or reply.
         """
-        lines = self.__document_lines[:]
-        email = []
-        broken = []
-
-        # Possible OCRing mistakes.
-        pos_froms = ["From", "Prom"]
-        # pos_sents = ["Sent", "Sant", "5ent", "Sont", "Semt"]
-        pos_sents = ["Date", "Sent"]
-        pos_fws = ['FW:', 'PIN:', 'FWD']
-        pos_res = ['RE:']
-
-        # patterns
-        #re_multi_space = re.compile(r"\s+")
-
-        from_locations = []
-
-        # If using the thread structure for emails.
-        if self.__use_threads:
-            for idx, line in enumerate(lines):
-                if idx < len(lines) - 1:
-                    # Goes through to find the locations of the froms, checks for from in the first 6 chars, then
-                    # if there is a sent in the next 5 lines.
-                    for x in xrange(1, 5):
-                        try:
-                            # Maybe try this later: (^(?:From|Prom))(?:.*(?:\n|\r)){1,5}^Sent
-                            if any(pos_from.lower() in lines[idx][0:6].lower() for pos_from in pos_froms) and any(
-                                            pos_sent.lower() in
-                                            lines[idx + x][0:6].lower() for pos_sent
-                                            in
-                                            pos_sents):
-                                from_locations.append(idx)
-                                break
-                        except IndexError:
-                            # No email breaks in file.
-                            self.__doc_should_be_checked = True
-                            break
-            for idx, line in enumerate(lines):
-                for from_location_idx, from_location in enumerate(from_locations):
-                    if idx == from_location:
-                        try:
-                            found_re_or_fw = False
-                            for x in xrange(2, 4):
-                                # Checks if any of the next few lines have fw in the subject line.
-                                if any(pos_fw.lower() in lines[idx + x].lower() for pos_fw in pos_fws):
-                                    # Cleans up multiple spaces.
-                                    for l in lines[idx:]:
-                                        email.append(re.sub(r'\s+', ' ', l.strip()))
-                                    broken.append(email)
-                                    email = []
-                                    found_re_or_fw = True
-                                    break
-                                # Checks if any of the next few lines have re in the subject line.
-                                elif any(pos_re.lower() in lines[idx + x].lower() for pos_re in pos_res):
-                                    # Cleans up multiple spaces.
-                                    for l in lines[idx:]:
-                                        email.append(re.sub(' +', ' ', l.strip()))
-                                    broken.append(email)
-                                    email = []
-                                    found_re_or_fw = True
-                                    break
-                            # If there were no forwards or replies in that specific email header.
-                            if not found_re_or_fw:
-                                # If not last from location, then
-                                # append the current email block from this from location to the next. i.e just
-                                # one email.
-                                if from_location_idx < len(from_locations) - 1:
-                                    for l in lines[idx:from_locations[from_location_idx + 1]]:
-                                        email.append(re.sub(' +', ' ', l.strip()))
-                                    broken.append(email)
-                                    email = []
-                                # It is the last from location, then add the rest of the document to the list of emails.
-                                else:
-                                    for l in lines[idx:]:
-                                        email.append(re.sub(' +', ' ', l.strip()))
-                                broken.append(email)
-                                email = []
-
-                        except IndexError:
-                            self.__doc_should_be_checked = True
-        # If you don't want to use email threading.
+        if isinstance(document_lines, (basestring, mmap.mmap)):
+            raw = LineBuffer(document_lines)
         else:
-            # Go through every line.
-            for idx, line in enumerate(lines):
-                # If it is not the last line, then identify all the from locations.
-                if idx < len(lines) - 1:
-                    for x in xrange(1, 5):
-                        try:
-                            if any(pos_from.lower() in lines[idx][0:6].lower() for pos_from in pos_froms) and any(
-                                            pos_sent.lower() in
-                                            lines[idx + x][0:6].lower() for pos_sent
-                                            in
-                                            pos_sents):
-                                from_locations.append(idx)
-                                break
-                        except IndexError:
-                            self.__doc_should_be_checked = True
-            # Add each email to the document.
-            for idx, line in enumerate(lines):
-                for from_location_idx, from_location in enumerate(from_locations):
-                    # If it is currently on a from location, add the next lines up until the next from location,
-                    if idx == from_location:
-                        # Adding to the next from location if it is not the end.
-                        if from_location_idx < len(from_locations) - 1:
-                            for l in lines[idx:from_locations[from_location_idx + 1]]:
-                                email.append(re.sub(' +', ' ', l.strip()))
-                            broken.append(email)
-                            email = []
-                        # If it's the end, add the rest of the document.
-                        else:
-                            for l in lines[idx:]:
-                                email.append(re.sub(' +', ' ', l.strip()))
-                        broken.append(email)
-                        email = []
-        return filter(None, broken)
+            raw = LineBuffer("".join(line if line.endswith("\n") else line + "\n" for line in document_lines))
+        # Cleans up multiple spaces.
+        self.__lines = LineBuffer(clean_lines(raw.get_data()))
+        emails = []
+        previous_replies = []
+        for start, end, replies_start in self._email_spans(raw):
+            emails.append(LineSpan(self.__lines, start, end))
+            if replies_start is None:
+                previous_replies.append(None)
+            else:
+                previous_replies.append(LineSpan(self.__lines, replies_start, end))
+        return emails, previous_replies
+
+    def _email_spans(self, lines):
+        """
+        Finds where each email starts and ends. An email starts at a from line that has a sent (or date) line in the
+        next 4 lines. When using threads, an email with FW or RE in its subject runs to the end of the document and
+        quotes the emails after it, otherwise it runs to the start of the next email. The from and sent lines are found
+        by searching the whole document, so the lines in between are never looked at one by one.
+
+        :param lines: The LineBuffer of the document.
+        :return: A generator of (start, end, replies_start) tuples, the email is lines[start:end], and its previous replies are lines[replies_start:end]. replies_start is None if it is not a forward or reply.
+        """
+        data = lines.get_data()
+        # Lines with from (or the OCRing mistake prom) in the first 6 chars.
+        from_lines = [lines.line_of(match.start()) for match in _FROM_LINE.finditer(data)]
+        # Lines with sent or date in the first 6 chars.
+        sent_lines = set(lines.line_of(match.start()) for match in _SENT_LINE.finditer(data))
+
+        # Goes through to find the locations of the froms, then checks if there is a sent in the next 4 lines. The last
+        # line can not be a from.
+        from_locations = []
+        for idx in from_lines:
+            if idx >= len(lines) - 1:
+                continue
+            for x in xrange(1, 5):
+                if idx + x >= len(lines):
+                    # No email breaks in file.
+                    self.__doc_should_be_checked = True
+                    break
+                if idx + x in sent_lines:
+                    from_locations.append(idx)
+                    break
+
+        for from_location_idx, from_location in enumerate(from_locations):
+            # If using the thread structure for emails.
+            if self.__use_threads:
+                try:
+                    is_thread = self._is_thread(lines, from_location)
+                except IndexError:
+                    # The header runs past the end of the document.
+                    self.__doc_should_be_checked = True
+                    continue
+                # A forward or reply holds the rest of the document, the emails after it are what it quotes.
+                if is_thread:
+                    if from_location_idx < len(from_locations) - 1:
+                        yield from_location, len(lines), from_locations[from_location_idx + 1]
+                    else:
+                        yield from_location, len(lines), len(lines)
+                    continue
+            # Just one email, up to the next from location, or the rest of the document if it is the last.
+            if from_location_idx < len(from_locations) - 1:
+                yield from_location, from_locations[from_location_idx + 1], None
+            else:
+                yield from_location, len(lines), None
+
+    def _is_thread(self, lines, from_location):
+        """
+        Checks if the subject of the email at a from location is a forward or a reply.
+
+        :param lines: The lines of the document.
+        :param from_location: The index of the from line of the email.
+        :return: Boolean, True if it is a forward or reply.
+        :raises IndexError: If the document ends before the subject.
+        """
+        pos_fws = ['fw:', 'pin:', 'fwd']
+        pos_res = ['re:']
+        for x in xrange(2, 4):
+            subject = lines[from_location + x].lower()
+            # Checks if any of the next few lines have fw in the subject line.
+            if any(pos_fw in subject for pos_fw in pos_fws):
+                return True
+            # Checks if any of the next few lines have re in the subject line.
+            elif any(pos_re in subject for pos_re in pos_res):
+                return True
+        return False
 
 
 class Collection(object):
     __documents_locs = []
     __debug = False
     __use_threads = True
+    __header_region_only = False
     __use_s3 = False
+    __line_cleaner = None
+    __document_cache = None
+    __s3_read_ahead = 4
+    __s3_read_ahead_bytes = 64 * 1024 * 1024
+    __shard_index = 0
+    __num_shards = 1
 
-    def __init__(self, file_location, file_type='.txt', use_s3=False):
+    def __init__(self, file_location, file_type='.txt', use_s3=False, s3_connection=None, shard_index=0, num_shards=1):
         """
         Creates a streaming object for all of the documents in a directory or s3 bucket.
 
@@ -465,10 +759,27 @@ class Collection(object):
         :type file_location: list, str
         :param file_type: The file type to look for in the directories, not used if using s3. Default is '.txt'
         :type file_type: str
+        :param use_s3: Boolean, True if file_location is in S3.
+        :param s3_connection: Optional S3 connection to use, such as s3_transfer.connect_s3(host, port) for a local stand-in.
+        :param shard_index: Int, which shard of the documents this collection is, from 0 to num_shards - 1.
+        :param num_shards: Int, how many shards to split the documents into, one for each machine. Every machine lists the same documents, and only keeps the ones whose ID hashes to its shard. See sharding.shard_of.
         :return: None
         """
+        if not 0 <= shard_index < num_shards:
+            raise ValueError("shard_index must be from 0 to num_shards - 1.")
+        self.__shard_index = shard_index
+        self.__num_shards = num_shards
         self.__use_s3 = use_s3
-        self.__bucket_dict = {}
+        # The locations of the documents, or (bucket_name, key_name) tuples if using s3.
+        self.__documents_locs = []
+        # The location of each document ID, made when a document is first looked up.
+        self.__doc_index = None
+        # The locations of the documents in this shard, made when a document is first looked up by position.
+        self.__shard_items = None
+        # Where to connect to S3 again from a worker process, None for Amazon.
+        self.__s3_address = None
+        if s3_connection is not None:
+            self.__s3_address = (s3_connection.host, s3_connection.port, s3_connection.is_secure)
 
         def pull_files(file_loc):
             for f in glob.glob(os.path.join(file_loc, "*" + file_type)):
@@ -478,65 +789,122 @@ class Collection(object):
                 else:
                     self.__documents_locs.append(f)
 
+        if type(file_location) is str:
+            file_location = [file_location]
         if not use_s3:
-            if type(file_location) is list:
-                for location in file_location:
-                    pull_files(location)
-            elif type(file_location) is str:
-                pull_files(file_location)
+            for location in file_location:
+                pull_files(location)
         else:
-            # Code for connecting to s3 bucket and streaming one by one the documents.
-            self.__s3 = boto.connect_s3()
-            if type(file_location) is list:
-                # Split the location by "/" to get the bucket name, then add it to a list and remove duplicates.
-                for location in file_location:
-                    self.__buckets.append(location.split("/")[0])
-                # Remove duplicates
-                self.__buckets = list(set(self.__buckets))
-
-                # Create a dictionary with the bucket as the key, and a list of strings as the value.
-                for bucket in self.__buckets:
-                    self.__bucket_dict[bucket] = []
-
-                # Get's the locations and add them to the bucket dic
-                for location in file_location:
-                    # Get the bucket
-                    bucket = location.split('/')[0]
-                    directory_list = location.split('/')[1:]
-
-                    # Rebuild the directory
-                    directory = "/".join(directory_list)
-                    # Only use those that have the prefix of the directory, then append them to the dic.
-                    for key in self.__s3.get_bucket(bucket).list(prefix=directory):
-                        if key.endsWith(file_type):
-                            self.__bucket_dict[bucket].append(key)
-            elif type(file_location) is str:
-                # Get the bucket
-                bucket = file_location.split('/')[0]
-                self.__bucket_dict[bucket] = []
-                directory_list = file_location.split('/')[1:]
-                directory = ''
-                # Rebuild the directory
-                for part in directory_list:
-                    directory += (part + "/")
-                directory = directory[:-1]
-                # Only use those that have the prefix of the directory, then append them to the dic.
-                for key in self.__s3.get_bucket(bucket).list(prefix=directory):
-                    if file_type in str(key):
-                        self.__bucket_dict[bucket].append(key)
+            # Documents are streamed one by one from S3 into memory.
+            self.__s3 = S3Transfer(s3_connection)
+            for location in file_location:
+                self.__documents_locs.extend(self.__s3.list_keys(location, file_type))
 
     def __getitem__(self, item):
-        self.__documents_locs = self.__documents_locs[item]
-        return self
+        """
+        Gets a document by its position, or a new Collection of a slice of the documents. The collection itself is not
+        changed.
+
+        :param item: Int or slice, the position of the document or documents in this collection.
+        :return: The Document, or the Collection of the slice.
+        """
+        if isinstance(item, slice):
+            return self._view(list(self._items())[item])
+        return self._load_document(self._shard_items()[item])
+
+    def filter(self, predicate):
+        """
+        Gets a new Collection of the documents whose ID the predicate is true for. The collection itself is not changed.
+
+        :param predicate: A function that takes a document ID, and returns True to keep the document.
+        :return: The Collection of the documents kept.
+        """
+        return self._view(item for item in self._items() if predicate(self._doc_id(item)))
+
+    def subset(self, doc_ids):
+        """
+        Gets a new Collection of the documents with the given IDs, in the order given. The collection itself is not
+        changed. IDs not in the collection, such as ones in another shard, are skipped.
+
+        :param doc_ids: A list of document IDs.
+        :return: The Collection of the documents.
+        """
+        index = self._doc_index()
+        return self._view(index[doc_id] for doc_id in doc_ids if doc_id in index)
+
+    def get(self, doc_id):
+        """
+        Gets a document by its ID, without going through the other documents.
+
+        :param doc_id: The ID of the document, its file name without the extension.
+        :return: The Document, None if it is not in the collection.
+        """
+        item = self.get_location(doc_id)
+        if item is None:
+            return None
+        return self._load_document(item)
+
+    def get_location(self, doc_id):
+        """
+        Gets where a document is by its ID.
+
+        :param doc_id: The ID of the document, its file name without the extension.
+        :return: The location of the document, or a (bucket_name, key_name) tuple if using s3. None if it is not in the collection.
+        """
+        return self._doc_index().get(doc_id)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_index()
 
     def add_document(self, document_loc):
         """
         Adds a document location to the list to iterate through.
 
-        :param document_loc: The location of the document to be added.
+        :param document_loc: The location of the document to be added, or a (bucket_name, key_name) tuple if using s3.
         :return: None.
         """
         self.__documents_locs.append(document_loc)
+        self.__doc_index = None
+        self.__shard_items = None
+
+    def _view(self, items):
+        """
+        Makes a new Collection with the same settings, of some of the documents of this one.
+
+        :param items: The document locations, or (bucket_name, key_name) tuples if using s3.
+        :return: The new Collection.
+        """
+        view = copy.copy(self)
+        view.__documents_locs = list(items)
+        view.__doc_index = None
+        view.__shard_items = None
+        return view
+
+    def _shard_items(self):
+        """
+        Gets where every document in this shard is, making the list the first time if the documents are sharded.
+
+        :return: A list of the document locations, or (bucket_name, key_name) tuples if using s3, in this shard.
+        """
+        if self.__num_shards == 1:
+            return self.__documents_locs
+        if self.__shard_items is None:
+            self.__shard_items = list(self._items())
+        return self.__shard_items
+
+    def _doc_index(self):
+        """
+        Gets the location of each document ID, making it the first time. If two documents have the same ID, the first
+        one is kept.
+
+        :return: A dictionary of document IDs to locations, or (bucket_name, key_name) tuples if using s3.
+        """
+        if self.__doc_index is None:
+            index = {}
+            for item in self._items():
+                index.setdefault(self._doc_id(item), item)
+            self.__doc_index = index
+        return self.__doc_index
 
     def set_debug(self, debug):
         """
@@ -561,24 +929,49 @@ class Collection(object):
 
         :return: The list of contact objects.
         """
-        contacts = []
         if self.__debug:
             print "\nPulling all contacts..."
             print "===================================="
-        for d in self:
-            for email in d:
-                contacts.append(Contact(email.get_from(), "(This info has been redacted)"))
-                tos = email.get_to().split(";")
-                ccs = email.get_cc().split(";")
-                for to in tos:
-                    contacts.append(Contact(to, "(This info has been redacted)"))
-                for cc in ccs:
-                    contacts.append(Contact(cc, "(This info has been redacted)"))
+        contacts = list(self.iter_contacts())
         if self.__debug:
             print "\nDone!"
             print "===================================="
         return contacts
 
+    def iter_contacts(self):
+        """
+        Pulls the contacts from the collection's to, from, and cc fields as each document is parsed, without keeping
+        them all in memory.
+
+        :return: A generator of contact objects, in the same order as pull_contacts. Each distinct string is parsed once, so the same frozen contact object is given for every time it is in the collection, see profile.ContactCache.
+        """
+        for d in self:
+            for email in d:
+                for raw in _contact_strings(email):
+                    yield CONTACT_CACHE.get(raw, "(This info has been redacted)")
+
+    def count_contacts(self):
+        """
+        Counts how many times each raw contact string is in the collection's to, from, and cc fields, and which
+        documents it is in. Only one record is kept for each distinct string, so it takes far less memory than
+        pull_contacts when the same contacts are in many emails.
+
+        :return: A list of (raw, count, doc_ids) tuples, most common first, where doc_ids is a sorted list of the IDs of the documents the string is in.
+        """
+        counts = {}
+        for d in self:
+            doc_id = d.get_doc_id()
+            for email in d:
+                for raw in _contact_strings(email):
+                    record = counts.get(raw)
+                    if record is None:
+                        record = counts[raw] = [0, set()]
+                    record[0] += 1
+                    record[1].add(doc_id)
+        records = [(raw, count, sorted(doc_ids)) for raw, (count, doc_ids) in counts.iteritems()]
+        records.sort(key=lambda record: (-record[1], record[0]))
+        return records
+
     def set_use_threads(self, use_threads):
         """
         Whether or not to use threads in emails
@@ -596,34 +989,333 @@ class Collection(object):
         """
         return self.__use_threads
 
+    def set_header_region_only(self, header_region_only):
+        """
+        Whether or not to only look for fields in the header at the top of each email, instead of in every line.
+
+        :param header_region_only: Boolean, True to stop looking for fields at the first line that is not one.
+        :return: None
+        """
+        self.__header_region_only = header_region_only
+
+    def get_header_region_only(self):
+        """
+        Gets if fields are only looked for in the header at the top of each email.
+
+        :return: The boolean representing only parsing the header or not.
+        """
+        return self.__header_region_only
+
+    def set_line_cleaner(self, line_cleaner):
+        """
+        Sets a LineCleaner to run on every line of a document before it is parsed. Ex. cleaning.OCR_CLEANER.
+
+        :param line_cleaner: The LineCleaner to use, None to parse the lines as they are.
+        :return: None
+        """
+        self.__line_cleaner = line_cleaner
+
+    def get_line_cleaner(self):
+        """
+        Gets the LineCleaner run on every line of a document before it is parsed.
+
+        :return: The LineCleaner, None if there is not one.
+        """
+        return self.__line_cleaner
+
+    def set_document_cache(self, document_cache):
+        """
+        Sets a DocumentCache to keep parsed documents in, so unchanged documents are not parsed again on the next run.
+        Only used for local directories.
+
+        :param document_cache: The document_cache.DocumentCache to use, None to parse every document.
+        :return: None
+        """
+        self.__document_cache = document_cache
+
+    def get_document_cache(self):
+        """
+        Gets the DocumentCache parsed documents are kept in.
+
+        :return: The DocumentCache, None if there is not one.
+        """
+        return self.__document_cache
+
+    def set_s3_read_ahead(self, read_ahead, max_bytes=64 * 1024 * 1024):
+        """
+        Sets how many documents are downloaded from S3 in the background while the current one is parsed. Default is 4
+        documents and 64 MB.
+
+        :param read_ahead: Int, how many documents past the current one can be downloading or waiting in memory. 0 downloads each document only when it is needed.
+        :param max_bytes: Int, no more documents start downloading while this many bytes are waiting in memory.
+        :return: None
+        """
+        self.__s3_read_ahead = read_ahead
+        self.__s3_read_ahead_bytes = max_bytes
+
+    def get_s3_read_ahead(self):
+        """
+        Gets how many documents are downloaded from S3 ahead of the one being parsed, and the bytes they can take up.
+
+        :return: A tuple of the number of documents and the number of bytes.
+        """
+        return self.__s3_read_ahead, self.__s3_read_ahead_bytes
+
+    def _parser_settings(self):
+        """
+        Gets the settings documents are parsed with, part of the key of a cached document.
+
+        :return: A list of strings.
+        """
+        settings = [str(PARSER_VERSION), str(self.__use_threads), str(self.__header_region_only)]
+        if self.__line_cleaner is not None:
+            settings += self.__line_cleaner.get_key()
+        return settings
+
+    def _read_lines(self, f):
+        """
+        Reads the lines of an open document, cleaning them if there is a line cleaner.
+
+        :param f: The open file.
+        :return: The list of lines.
+        """
+        lines = f.readlines()
+        if self.__line_cleaner is not None:
+            lines = list(self.__line_cleaner.clean_lines(lines))
+        return lines
+
+    def _read_contents(self, f):
+        """
+        Reads an open document. Without a line cleaner the file is mapped into memory instead of being read into lines.
+
+        :param f: The open file.
+        :return: The contents as an mmap or string, or the list of cleaned lines if there is a line cleaner.
+        """
+        if self.__line_cleaner is not None:
+            return self._read_lines(f)
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # Empty files can not be mapped.
+            return f.read()
+
+    def get_shard(self):
+        """
+        Gets which shard of the documents this collection is.
+
+        :return: A tuple of the shard index and the number of shards.
+        """
+        return self.__shard_index, self.__num_shards
+
     def __len__(self):
+        return len(self._shard_items())
+
+    def imap(self, func, workers=None, ordered=False, chunksize=1):
+        """
+        Parses the documents in worker processes, and runs a function on each one there. Only what the function returns
+        is sent back, so return something small, like the contacts of the document, not the Document.
+
+        :param func: A function that takes a Document. What it returns must be picklable.
+        :param workers: Int, how many processes to use. Default is the number of CPUs.
+        :param ordered: Boolean, True to get the results in the order of the documents, instead of as they finish.
+        :param chunksize: Int, how many documents to send to a process at a time.
+        :return: A generator of what func returns for each document.
+        """
+        _num = 0
+        _len_of_docs = len(self)
+        pool = Pool(workers, _start_worker, (self, func))
+        try:
+            if ordered:
+                results = pool.imap(_run_in_worker, self._items(), chunksize)
+            else:
+                results = pool.imap_unordered(_run_in_worker, self._items(), chunksize)
+            for result in results:
+                if self.__debug:
+                    print ("\r" + str((float(_num) / _len_of_docs) * 100) + "% done with document iteration."),
+                _num += 1
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def query(self, email_index, **fields):
+        """
+        Finds emails with an email_index.EmailIndex of this collection, and only parses the documents they are in.
+
+        :param email_index: The EmailIndex the collection was indexed into. Index it again if the documents change.
+        :param fields: The fields to match, see EmailIndex.find. Ex. from_="alice", has_attachments=True.
+        :return: A generator of the matching Email objects, ordered by document and position.
+        """
+        matches = email_index.find(**fields)
+        if not matches:
+            return
+        items = self._doc_index()
+        for doc_id, positions in groupby(matches, itemgetter(0)):
+            if doc_id not in items:
+                continue
+            emails = list(self._load_document(items[doc_id]))
+            for doc_id, position in positions:
+                if position < len(emails):
+                    yield emails[position]
+
+    def time_buckets(self, period="month", email_index=None):
+        """
+        Splits the emails of the collection up by when they were sent, to work on one period of time at a time.
+
+        :param period: "year", "month", "week", or "day".
+        :param email_index: Optional email_index.EmailIndex of this collection, to read the sent times from instead of parsing every document.
+        :return: A list of (start, emails) tuples ordered by start, where emails is a list of (doc_id, position) tuples sent in the period starting at start. Emails without a sent date that could be parsed are last, with a start of None.
+        """
+        buckets = {}
+        if email_index is not None:
+            for doc_id, position, sent in email_index.get_sent_times():
+                start = None if sent is None else bucket_start(datetime.utcfromtimestamp(sent), period)
+                buckets.setdefault(start, []).append((doc_id, position))
+        else:
+            for d in self:
+                for position, email in enumerate(d):
+                    sent = email.get_sent_datetime()
+                    start = None if sent is None else bucket_start(sent, period)
+                    buckets.setdefault(start, []).append((d.get_doc_id(), position))
+        undated = buckets.pop(None, None)
+        ordered = sorted(buckets.items())
+        if undated is not None:
+            ordered.append((None, undated))
+        return ordered
+
+    def _items(self):
+        """
+        Gets where every document is.
+
+        :return: A generator of the document locations, or (bucket_name, key_name) tuples if using s3, in this shard.
+        """
+        for item in self.__documents_locs:
+            if self.__num_shards == 1 or shard_of(self._doc_id(item), self.__num_shards) == self.__shard_index:
+                yield item
+
+    def _load_document(self, item):
+        """
+        Reads and parses a document.
+
+        :param item: The location of the document, or a (bucket_name, key_name) tuple if using s3.
+        :return: The Document.
+        """
+        doc_id = self._doc_id(item)
         if not self.__use_s3:
-            return len(self.__documents_locs)
+            key = None
+            if self.__document_cache is not None:
+                key = self.__document_cache.make_key(item, self._parser_settings())
+                parsed = self.__document_cache.get(key)
+                if parsed is not None:
+                    return Document(None, self.__use_threads, doc_id, self.__header_region_only, parsed)
+            with open(item) as f:
+                contents = self._read_contents(f)
+                d = Document(contents, self.__use_threads, doc_id, self.__header_region_only)
+                # The document keeps its own cleaned copy of the text.
+                if isinstance(contents, mmap.mmap):
+                    contents.close()
+            if key is not None:
+                self.__document_cache.set(key, d.get_parsed())
+            return d
+        bucket_name, key_name = item
+        return self._parse_s3_contents(item, self.__s3.read(bucket_name, key_name))
+
+    def _parse_s3_contents(self, item, contents):
+        """
+        Parses a document read from S3.
+
+        :param item: The (bucket_name, key_name) tuple of the document.
+        :param contents: The contents of the key.
+        :return: The Document.
+        """
+        if self.__line_cleaner is not None:
+            contents = list(self.__line_cleaner.clean_lines(contents.splitlines(True)))
+        return Document(contents, self.__use_threads, self._doc_id(item), self.__header_region_only)
+
+    def _doc_id(self, item):
+        """
+        Gets the ID of a document from where it is.
+
+        :param item: The location of the document, or a (bucket_name, key_name) tuple if using s3.
+        :return: The document ID, its file name without the extension.
+        """
+        if not self.__use_s3:
+            return os.path.basename(item).split(".")[0]
+        return item[1].split("/")[-1].split(".")[0]
+
+    def _reconnect_s3(self):
+        """
+        Connects to S3 again, so a worker process does not share the connections of the process it was forked from.
+
+        :return: None
+        """
+        if self.__use_s3:
+            if self.__s3_address is None:
+                self.__s3 = S3Transfer()
+            else:
+                self.__s3 = S3Transfer(connect_s3(*self.__s3_address))
+
+    def _iter_loaded(self):
+        """
+        Reads and parses every document in order. Documents in S3 are downloaded ahead in background threads, so the
+        next ones arrive while the current one is parsed.
+
+        :return: A generator of Documents.
+        """
+        if self.__use_s3 and self.__s3_read_ahead > 0:
+            for item, contents in self.__s3.prefetch(self._items(), self.__s3_read_ahead, self.__s3_read_ahead_bytes):
+                yield self._parse_s3_contents(item, contents)
         else:
-            length = 0
-            for bucket_key in self.__bucket_dict:
-                length += len(self.__bucket_dict[bucket_key])
-            return length
+            for item in self._items():
+                yield self._load_document(item)
 
     def __iter__(self):
         _num = 0
         _len_of_docs = len(self)
-        if not self.__use_s3:
-            for loc in self.__documents_locs:
-                with open(loc) as f:
-                    if self.__debug:
-                        print ("\r" + str((float(_num) / _len_of_docs) * 100) + "% done with document iteration."),
-                    _num += 1
-                    d = Document(f.readlines(), self.__use_threads, os.path.basename(f.name).split(".")[0])
-                    yield d
-        else:
-            for bucket_name in self.__bucket_dict:
-                bucket = self.__s3.get_bucket(bucket_name)
-                for key in self.__bucket_dict[bucket_name]:
-                    f = open("temp_data.txt", 'w')
-                    bucket.get_key(key).get_contents_to_file(f)
-                    f.close()
-                    f = open("temp_data.txt", 'r')
-                    d = Document(f.readlines(), self.__use_threads, os.path.basename(f.name).split(".")[0])
-                    f.close()
-                    yield d
+        for document in self._iter_loaded():
+            if self.__debug:
+                print ("\r" + str((float(_num) / _len_of_docs) * 100) + "% done with document iteration."),
+            _num += 1
+            yield document
+
+
+def _contact_strings(email):
+    """
+    Gets the raw contact strings of an email, the from field, then each of the to and cc fields split on semicolons.
+
+    :param email: The Email.
+    :return: A generator of the raw strings.
+    """
+    yield email.get_from()
+    for to in email.get_to().split(";"):
+        yield to
+    for cc in email.get_cc().split(";"):
+        yield cc
+
+
+# The collection and function of a worker process of Collection.imap, set when the process starts.
+_worker_state = {}
+
+
+def _start_worker(collection, func):
+    """
+    Sets up a worker process of Collection.imap.
+
+    :param collection: The Collection being iterated.
+    :param func: The function to run on each document.
+    :return: None
+    """
+    collection._reconnect_s3()
+    _worker_state['collection'] = collection
+    _worker_state['func'] = func
+
+
+def _run_in_worker(item):
+    """
+    Parses a document in a worker process of Collection.imap, and runs the function on it.
+
+    :param item: The location of the document, or a (bucket_name, key_name) tuple if using s3.
+    :return: What the function returned.
+    """
+    return _worker_state['func'](_worker_state['collection']._load_document(item))
@@ -4,17 +4,92 @@ email_getter.py
 This file downloads a file from a server after being provided with a list of links.
 
 - FileCreator: Creates, converts, and fixes the resulting text files.
+- split_pages: Groups the lines of a converted file into pages.
+- fix_lines: Removes the headers and footers from the lines of a converted file and cleans them, a page at a time.
+- fix_file: Runs fix_lines over a converted file in place.
+
+Downloading is done by the Downloader in downloader.py.
 
 """
 __author__ = 'alex'
-import urllib2
-import re
 import os
 import glob
-from subprocess import call
-
-import boto
-from boto.s3.key import Key
+import shutil
+import tempfile
+import time
+
+from cleaning import REDACTION_CLEANER
+from converter import Converter, ConversionCache
+from downloader import Downloader, DownloadManifest
+from email_datatypes import Document
+from pipeline import Pipeline
+from s3_transfer import S3Transfer, split_location
+
+
+def split_pages(lines):
+    """
+    Groups the lines of a converted file into pages. pdftotext starts every page after the first with a form feed
+    ("\\f"), so a line containing one begins a new page.
+
+    :param lines: An iterable of lines, such as an open file or pdftotext's stdout.
+    :return: A generator of (page, is_last) tuples, where page is the list of lines on that page.
+    """
+    page = None
+    for line in lines:
+        if page is None:
+            page = [line]
+        elif "\f" in line:
+            yield page, False
+            page = [line]
+        else:
+            page.append(line)
+    if page is not None:
+        yield page, True
+
+
+def fix_lines(lines, top_chop, header_size, footer_size, cleaner=REDACTION_CLEANER):
+    """
+    Fixes the lines of a converted file one page at a time, so a whole file never has to be held in memory. Removes
+    the first top_chop lines of the file, the first header_size lines of every page after the first, and the last
+    footer_size lines of every page followed by a page break, then strips and cleans every line.
+
+    :param lines: An iterable of lines, such as an open file or pdftotext's stdout.
+    :param top_chop: How many lines to remove at the top of the file.
+    :param header_size: How many lines to remove at the top of a page.
+    :param footer_size: How many lines to remove at the bottom of a page.
+    :param cleaner: The LineCleaner to run on every line. Default only marks redactions.
+    :return: A generator of the fixed lines, without line endings.
+    """
+    clean = cleaner.clean
+    to_chop = top_chop
+    first = True
+    for page, is_last in split_pages(lines):
+        start = 0 if first else header_size
+        end = len(page) if is_last else len(page) - footer_size
+        first = False
+        for idx in xrange(start, end):
+            if to_chop:
+                to_chop -= 1
+                continue
+            yield clean(page[idx].strip())
+
+
+def fix_file(file_to_fix, top_chop, header_size, footer_size, cleaner=REDACTION_CLEANER):
+    """
+    Fixes a converted file in place with fix_lines. The fixed lines are written next to the file, then swapped in.
+
+    :param file_to_fix: The text file to fix.
+    :param top_chop: How many lines to remove at the top of the file.
+    :param header_size: How many lines to remove at the top of a page.
+    :param footer_size: How many lines to remove at the bottom of a page.
+    :param cleaner: The LineCleaner to run on every line. Default only marks redactions.
+    :return: None
+    """
+    with open(file_to_fix, "r") as f:
+        with open(file_to_fix + ".part", "wb") as out:
+            for line in fix_lines(f, top_chop, header_size, footer_size, cleaner):
+                out.write(line + "\n")
+    os.rename(file_to_fix + ".part", file_to_fix)
 
 
 class FileCreator:
@@ -26,6 +101,23 @@ class FileCreator:
     __fix_files = None
     __fixing_chops = None
     __s3 = None
+    __use_s3 = False
+    __s3_connection = None
+    __s3_workers = 4
+    __download_workers = 1
+    __download_retries = 3
+    __download_backoff = 1.0
+    __use_download_manifest = True
+    __download_manifest = None
+    __revalidate_downloads = False
+    __convert_workers = 1
+    __convert_timeout = None
+    __use_conversion_cache = True
+    __conversion_cache = None
+    __fuse_fix = False
+    __split_large_pdfs = None
+    __pages_per_part = 100
+    __line_cleaner = REDACTION_CLEANER
 
     def __init__(self, **kwargs):
         """
@@ -38,6 +130,23 @@ class FileCreator:
         :param convert_output_dir: The directory where the text files should go.
         :param fix_files: Boolean, true if files should be fixed.
         :param fixing_chops: A list of three ints, top_chop, header_size, footer_size. Ex. [8,5,5].
+        :param download_workers: Int, how many PDFs to download at the same time. Default is 1.
+        :param download_retries: Int, how many times to retry a PDF that failed to download. Default is 3.
+        :param download_backoff: Float, seconds to wait before the first retry, doubled after each retry. Default is 1.0.
+        :param use_download_manifest: Boolean, if True PDFs downloaded by an earlier run are skipped and partial ones resumed. Default is True.
+        :param download_manifest: File location of the download manifest. Default is download_manifest.json in where_to_download.
+        :param revalidate_downloads: Boolean, if True PDFs already downloaded are checked with the server for changes. Default is False.
+        :param convert_workers: Int, how many pdftotext processes to run at the same time. Default is 1.
+        :param convert_timeout: Seconds one PDF may take to convert before it is skipped. Default is None, no limit.
+        :param split_large_pdfs: Optional int. PDFs with more pages than this are converted in page ranges at the same time. Needs pdfinfo. Default is None, never split.
+        :param pages_per_part: Int, how many pages of a large PDF each pdftotext converts. Default is 100.
+        :param use_conversion_cache: Boolean, if True PDFs that have not changed since they were last converted are skipped. Default is True.
+        :param conversion_cache: File location of the conversion cache. Default is conversion_cache.json in convert_output_dir.
+        :param use_s3: Boolean, if True where_to_download and convert_output_dir are S3 locations like "mybucket/mydir/".
+        :param s3_connection: Optional S3 connection to use, such as s3_transfer.connect_s3(host, port) for a local stand-in.
+        :param s3_workers: Int, how many S3 keys to read and write at the same time. Default is 4.
+        :param line_cleaner: The LineCleaner run on every line when fixing files. Default only marks redactions.
+        :param fuse_fix: Boolean, if True and both convert and fix_files are set, files are fixed as pdftotext writes them instead of in a second pass. Default is False.
         """
         if 'download_emails' in kwargs:
             self.__download_emails = kwargs['download_emails']
@@ -55,6 +164,38 @@ class FileCreator:
             self.__fixing_chops = kwargs['fixing_chops'][:]
         if 'use_s3' in kwargs:
             self.__use_s3 = kwargs['use_s3']
+        if 's3_connection' in kwargs:
+            self.__s3_connection = kwargs['s3_connection']
+        if 's3_workers' in kwargs:
+            self.__s3_workers = kwargs['s3_workers']
+        if 'download_workers' in kwargs:
+            self.__download_workers = kwargs['download_workers']
+        if 'download_retries' in kwargs:
+            self.__download_retries = kwargs['download_retries']
+        if 'download_backoff' in kwargs:
+            self.__download_backoff = kwargs['download_backoff']
+        if 'use_download_manifest' in kwargs:
+            self.__use_download_manifest = kwargs['use_download_manifest']
+        if 'download_manifest' in kwargs:
+            self.__download_manifest = kwargs['download_manifest']
+        if 'revalidate_downloads' in kwargs:
+            self.__revalidate_downloads = kwargs['revalidate_downloads']
+        if 'convert_workers' in kwargs:
+            self.__convert_workers = kwargs['convert_workers']
+        if 'convert_timeout' in kwargs:
+            self.__convert_timeout = kwargs['convert_timeout']
+        if 'split_large_pdfs' in kwargs:
+            self.__split_large_pdfs = kwargs['split_large_pdfs']
+        if 'pages_per_part' in kwargs:
+            self.__pages_per_part = kwargs['pages_per_part']
+        if 'use_conversion_cache' in kwargs:
+            self.__use_conversion_cache = kwargs['use_conversion_cache']
+        if 'conversion_cache' in kwargs:
+            self.__conversion_cache = kwargs['conversion_cache']
+        if 'fuse_fix' in kwargs:
+            self.__fuse_fix = kwargs['fuse_fix']
+        if 'line_cleaner' in kwargs:
+            self.__line_cleaner = kwargs['line_cleaner']
 
     def start(self):
         """
@@ -63,14 +204,112 @@ class FileCreator:
         :return: None
         :rtype: None
         """
-        if self.__use_s3:
-            self.__s3 = boto.connect_s3()
         if self.__download_emails:
             self._download_emails()
+        converted = None
+        cache = None
+        if self.__convert:
+            converter = self._make_converter()
+            converted = self._convert_emails(converter)['converted']
+            cache = converter.get_cache()
+        elif self.__fix_files:
+            cache = self._make_conversion_cache(only_existing=True)
+        if self.__fix_files and not (self.__convert and self.__fuse_fix):
+            if cache is not None and converted is not None:
+                # The cache records which text files were fixed, so ones it skipped are fixed if a run stopped before
+                # fixing them.
+                fix_key = self._fix_key()
+                converted = [txt_path for pdf_path, txt_path in self._conversion_jobs()
+                             if cache.needs_fixing(txt_path, fix_key)]
+            self._fix_files(self.__fixing_chops[0], self.__fixing_chops[1], self.__fixing_chops[2], converted, cache)
+
+    def iter_documents(self, use_threads=True, fix_workers=1, parse_workers=1, queue_size=16,
+                       header_region_only=False):
+        """
+        Runs everything that you specified as a pipeline instead of one step after another. Each PDF is converted as
+        soon as it is downloaded, fixed as soon as it is converted, and parsed as soon as it is fixed, so the first
+        documents come out while the rest are still downloading. Only works with local directories.
+
+        :param use_threads: Boolean if to break emails up into threads or not, passed to each Document.
+        :param fix_workers: Int, how many files to fix at the same time. Downloads and conversions use download_workers and convert_workers.
+        :param parse_workers: Int, how many files to parse at the same time.
+        :param queue_size: Int, how many files can wait between two steps before the earlier step waits too.
+        :param header_region_only: Boolean if to only look for fields in the header of each email, passed to each Document.
+        :return: A generator of Document objects, in the order they finish.
+        """
+        if self.__use_s3:
+            raise ValueError("iter_documents only works with local directories.")
+        if self.__download_emails and not self.__convert:
+            raise ValueError("iter_documents can only parse downloaded PDFs if they are converted.")
+        pipeline = Pipeline(queue_size)
+        fused = self.__convert and self.__fix_files and self.__fuse_fix
+        downloader = None
+
+        if self.__download_emails:
+            urls = [line.strip() for line in open(self.__pdf_list_file, 'r').readlines() if line.strip()]
+            items = [(url, os.path.join(self.__where_to_download, url.split("/")[-1].split(".")[0] + ".pdf"))
+                     for url in urls]
+            downloader = self._make_downloader(self.__where_to_download)
+
+            def download(job):
+                downloader.fetch(job[0], job[1])
+                return job[1]
+
+            pipeline.add_stage("download", download, self.__download_workers, downloader.close)
+        elif self.__convert:
+            items = [os.path.join(self.__where_to_download, f)
+                     for f in glob.glob1(self.__where_to_download, "*.pdf")]
+        else:
+            # Every text file is fixed when nothing is converted, like start().
+            items = [(to_fix, True) for to_fix in glob.glob(os.path.join(self.__convert_output_dir, "*.txt"))]
+
+        cache = None
         if self.__convert:
-            self._convert_emails()
-        if self.__fix_files:
-            self._fix_files(self.__fixing_chops[0], self.__fixing_chops[1], self.__fixing_chops[2])
+            converter = self._make_converter()
+            cache = converter.get_cache()
+            fix_key = self._fix_key() if self.__fix_files else None
+
+            def convert(pdf_path):
+                txt_path = os.path.join(self.__convert_output_dir, os.path.basename(pdf_path) + ".txt")
+                elapsed = converter.convert_one(pdf_path, txt_path)
+                # Text the cache skipped only needs fixing if the cache does not show it was fixed.
+                needs_fixing = elapsed is not None or (fix_key is not None and cache.needs_fixing(txt_path, fix_key))
+                return txt_path, needs_fixing and not fused
+
+            pipeline.add_stage("convert", convert, self.__convert_workers)
+        elif self.__fix_files:
+            cache = self._make_conversion_cache(only_existing=True)
+
+        if self.__fix_files and not fused:
+            top_chop, header_size, footer_size = self.__fixing_chops[:3]
+            fix_key = self._fix_key()
+
+            def fix(item):
+                if item[1]:
+                    fix_file(item[0], top_chop, header_size, footer_size, self.__line_cleaner)
+                    if cache is not None:
+                        cache.set_fixed(item[0], fix_key)
+                return item
+
+            pipeline.add_stage("fix", fix, fix_workers)
+
+        def parse(item):
+            with open(item[0]) as f:
+                return Document(f.read(), use_threads, os.path.basename(f.name).split(".")[0],
+                                header_region_only)
+
+        pipeline.add_stage("parse", parse, parse_workers)
+
+        try:
+            for document in pipeline.run(items):
+                yield document
+        finally:
+            if downloader is not None and downloader.get_manifest() is not None:
+                downloader.get_manifest().save()
+            if cache is not None:
+                cache.save()
+            for stage, item, error in pipeline.get_errors():
+                print("\nCould not " + stage + " " + str(item) + ": " + str(error))
 
     def get_download_emails(self):
         """
@@ -128,6 +367,22 @@ class FileCreator:
         """
         return self.__fixing_chops
 
+    def get_download_workers(self):
+        """
+        Gets the number of PDFs downloaded at the same time.
+
+        :return: The number of download workers.
+        """
+        return self.__download_workers
+
+    def get_convert_workers(self):
+        """
+        Gets the number of PDFs converted at the same time.
+
+        :return: The number of convert workers.
+        """
+        return self.__convert_workers
+
     def set_download_emails(self, download_emails):
         """
         Set to download emails.
@@ -182,128 +437,269 @@ class FileCreator:
         """
         self.__fixing_chops = fixing_chops
 
-    def _convert_emails(self):
+    def set_download_workers(self, download_workers):
         """
-        Converts emails to text files using pdftotext.
+        Set how many PDFs to download at the same time.
 
-        :return: None
+        :param download_workers: The number of download workers.
+        :return: None.
         """
-        if self.__use_s3:
-            self.__s3 = boto.connect_s3()
-            # Get the bucket
-            bucket = self.__where_to_download.split('/')[0]
-            directory_list = self.__where_to_download.split('/')[1:]
-            directory = ''
-            # Rebuild the directory
-            for part in directory_list:
-                directory += (part + "/")
-            directory = directory[:-1]
-            bucket = self.__s3.get_bucket(bucket)
-            pdf_locations = bucket.list(prefix=directory)
-
-            for location in pdf_locations:
-                name = location.split('/')[-1]
-                pdf = open("temp/temp.pdf", "wb")
-                bucket.get_key(location).get_contents_to_file(pdf)
-                call(["pdftotext", "-layout", "-enc", "UTF-8", os.path.abspath(pdf.name),
-                      "temp/" + name + ".txt"])
-                k = Key(bucket)
-                where = self.__convert_output_dir.split("/")
-                where = where[1:]
-                where = where.join("/")
-                k.key = where + '/' + name + '.txt'
-                text_file = open('temp/' + name + '.txt', "r")
-                k.set_contents_from_filename(text_file)
-
-        for f in glob.glob1(os.path.join(self.__where_to_download), "*.pdf"):
-            call(["pdftotext", "-layout", "-enc", "UTF-8", os.path.join(self.__where_to_download, f),
-                  os.path.join(self.__convert_output_dir, os.path.basename(f) + ".txt")])
+        self.__download_workers = download_workers
 
-    def _download_emails(self):
+    def set_convert_workers(self, convert_workers):
         """
-        Downloads emails to the specified folder from a file containing a new link on each line.
+        Set how many PDFs to convert at the same time.
 
-        :return: None, downloads files to folder.
+        :param convert_workers: The number of convert workers.
+        :return: None.
         """
+        self.__convert_workers = convert_workers
 
-        lines = open(self.__pdf_list_file, 'r').readlines()
-        for idx, url in enumerate(lines):
-            url_split = url.split("/")
-            f = urllib2.urlopen(url)
-            data = f.read()
-            if self.__use_s3:
-                bucket = self.__s3.get_bucket(self.__where_to_download.split("/")[0])
-                k = Key(bucket)
-                where = self.__where_to_download.split("/")[1:].join("/") + "/"
-                name = url_split[-1].split(".")[0] + ".pdf"
-                with open("temp/" + name, "wb") as pdf:
-                    pdf.write(data)
-                    k.key = where + name
-                    k.set_contents_from_file(pdf)
-            else:
-                with open(os.path.join(self.__where_to_download, url_split[-1].split(".")[0] + ".pdf"), "wb") as pdf:
-                    pdf.write(data)
-                print("\r" + str(float(idx) / len(lines) * 100) + "% done with download."),
+    def _convert_emails(self, converter=None):
+        """
+        Converts emails to text files using pdftotext, running convert_workers conversions at the same time. With
+        fuse_fix, every file is also fixed while it is being converted.
 
-    def _fix_files(self, top_chop, header_size, footer_size):
+        :param converter: Optional Converter to use. Default is one made by _make_converter.
+        :return: The report from Converter.convert, with the time each PDF took and the PDFs that failed.
+        :rtype: dict
         """
-        Fixes a file and makes it left aligned and removes header and footer.
+        def progress(done, total, pdf_path, error):
+            if error is not None:
+                print("\nCould not convert " + str(pdf_path) + ": " + str(error))
+            print("\r" + str(float(done) / total * 100) + "% done with conversion."),
 
-        :param top_chop: How many lines to remove at the top of the file.
-        :param header_size: How many lines to remove at the top of a page.
-        :param footer_size: How many lines to remove at the bottom of a page.
-        :return: None, fixes a file
+        if converter is None:
+            converter = self._make_converter()
+        if self.__use_s3:
+            report = self._convert_emails_s3(converter, progress)
+        else:
+            report = converter.convert(self._conversion_jobs(), progress)
+        if report['skipped']:
+            print("\nSkipped " + str(len(report['skipped'])) + " PDFs that have not changed since they were converted.")
+        if report['times']:
+            slowest = sorted(report['times'].items(), key=lambda item: item[1], reverse=True)
+            print("\nConverted " + str(len(report['times'])) + " PDFs in " + str(report['total_time']) +
+                  " seconds, " + str(sum(report['times'].values()) / len(report['times'])) + " seconds on average.")
+            for pdf_path, seconds in slowest[:5]:
+                print("    " + str(pdf_path) + ": " + str(seconds) + " seconds")
+        if report['failed']:
+            print(str(len(report['failed'])) + " PDFs could not be converted.")
+        return report
+
+    def _conversion_jobs(self):
+        """
+        Gets the local PDFs to convert and the text file each one is converted to.
+
+        :return: A list of (pdf_path, txt_path) tuples.
+        """
+        return [(os.path.join(self.__where_to_download, f),
+                 os.path.join(self.__convert_output_dir, os.path.basename(f) + ".txt"))
+                for f in glob.glob1(os.path.join(self.__where_to_download), "*.pdf")]
+
+    def _make_conversion_cache(self, only_existing=False):
+        """
+        Creates the ConversionCache, if it is used.
+
+        :param only_existing: Boolean, if True only open the cache if its file already exists, for runs that fix without converting.
+        :return: The ConversionCache, None if it is not used.
+        """
+        if not self.__use_conversion_cache or self.__use_s3:
+            return None
+        cache_file = self.__conversion_cache
+        if cache_file is None:
+            cache_file = os.path.join(self.__convert_output_dir, "conversion_cache.json")
+        if only_existing and not os.path.exists(cache_file):
+            return None
+        return ConversionCache(cache_file)
+
+    def _fix_key(self):
+        """
+        Gets the settings files are fixed with, kept in the conversion cache so changing them fixes files again.
+
+        :return: A list of strings.
+        """
+        top_chop, header_size, footer_size = self.__fixing_chops[:3]
+        return ["fix_lines", str(top_chop), str(header_size), str(footer_size)] + self.__line_cleaner.get_key()
+
+    def _make_converter(self):
+        """
+        Creates the Converter for the conversion settings, with the conversion cache and, with fuse_fix, fix_lines
+        as its line filter.
+
+        :return: The Converter.
+        """
+        line_filter = None
+        line_filter_key = None
+        fix_key = None
+        if self.__fix_files and self.__fuse_fix:
+            top_chop, header_size, footer_size = self.__fixing_chops[:3]
+            cleaner = self.__line_cleaner
+
+            def line_filter(lines):
+                return fix_lines(lines, top_chop, header_size, footer_size, cleaner)
+
+            line_filter_key = self._fix_key()
+        elif self.__fix_files:
+            fix_key = self._fix_key()
+
+        return Converter(workers=self.__convert_workers, timeout=self.__convert_timeout,
+                         cache=self._make_conversion_cache(), line_filter=line_filter, line_filter_key=line_filter_key,
+                         split_threshold=self.__split_large_pdfs, pages_per_part=self.__pages_per_part, fix_key=fix_key)
+
+    def _convert_emails_s3(self, converter, progress):
+        """
+        Converts the PDFs in the S3 location where_to_download into text keys in convert_output_dir, s3_workers at a
+        time. Each worker writes its PDF to its own temporary file for pdftotext, and the text goes straight from
+        pdftotext's output to S3.
+
+        :param converter: The Converter to use.
+        :param progress: Function called with (done, total, pdf_key, error) after each PDF.
+        :return: A report like the one from Converter.convert, with (bucket_name, key_name) tuples in place of paths.
+        :rtype: dict
+        """
+        s3 = self._get_s3()
+        start = time.time()
+        out_bucket, out_directory = split_location(self.__convert_output_dir)
+        if out_directory and not out_directory.endswith("/"):
+            out_directory += "/"
+        pdf_keys = s3.list_keys(self.__where_to_download, ".pdf")
+        done = [0]
+
+        def convert(pdf_key):
+            bucket_name, key_name = pdf_key
+            convert_start = time.time()
+            with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf:
+                pdf.write(s3.read(bucket_name, key_name))
+                pdf.flush()
+                text = converter.convert_to_string(pdf.name)
+            txt_key = (out_bucket, out_directory + key_name.split("/")[-1] + ".txt")
+            s3.write(txt_key[0], txt_key[1], text)
+            return txt_key, time.time() - convert_start
+
+        report = {'times': {}, 'converted': [], 'skipped': [], 'failed': {}, 'total_time': 0.0}
+        for pdf_key, result, error in s3.map(convert, pdf_keys):
+            done[0] += 1
+            if error is not None:
+                report['failed'][pdf_key] = str(error)
+            else:
+                report['converted'].append(result[0])
+                report['times'][pdf_key] = result[1]
+            progress(done[0], len(pdf_keys), pdf_key, error)
+        report['total_time'] = time.time() - start
+        return report
+
+    def _get_s3(self):
         """
-        redacted_strings = ["B6", "B5", "B4", "B3", "B2"]
+        Gets the S3Transfer used for every S3 location, creating it the first time.
 
-        def fix(file_to_fix):
-            # Creates list to store lines
-            to_write = []
+        :return: The S3Transfer.
+        """
+        if self.__s3 is None:
+            self.__s3 = S3Transfer(self.__s3_connection, workers=self.__s3_workers)
+        return self.__s3
 
-            # Opens the file to read, then wipes it blank to write
-            f = open(file_to_fix, "r")
-            lines = f.readlines()
-            f.close()
-            f = open(file_to_fix, "wb+")
+    def _download_emails(self):
+        """
+        Downloads emails to the specified folder from a file containing a new link on each line. PDFs that the
+        download manifest shows were already downloaded are skipped.
 
-            # Adds to the list of lines
-            for line in lines:
-                to_write.append(line)
+        :return: The report from Downloader.download, the links that were downloaded, resumed, unchanged, skipped, or failed.
+        :rtype: dict
+        """
+        urls = [line.strip() for line in open(self.__pdf_list_file, 'r').readlines() if line.strip()]
+        names = [url.split("/")[-1].split(".")[0] + ".pdf" for url in urls]
+        if self.__use_s3:
+            # Each PDF only touches the disk between its download and its upload.
+            where = tempfile.mkdtemp()
+            s3 = self._get_s3()
+            bucket_name, directory = split_location(self.__where_to_download)
+            if directory and not directory.endswith("/"):
+                directory += "/"
+            # PDFs already in the bucket do not need to be downloaded again.
+            existing = set(key_name for _, key_name in s3.list_keys(self.__where_to_download, ".pdf"))
+            jobs = [(url, os.path.join(where, name)) for url, name in zip(urls, names)
+                    if directory + name not in existing]
+        else:
+            where = self.__where_to_download
+            jobs = [(url, os.path.join(where, name)) for url, name in zip(urls, names)]
 
-            # Deletes the header and footer around the feed return or "\f"
-            for idx, l in enumerate(to_write):
-                if l.find("\f") != -1:
-                    del to_write[idx - footer_size:idx + header_size]
+        def progress(done, total, url, error):
+            if error is not None:
+                print("\nCould not download " + url + ": " + str(error))
+            print("\r" + str(float(done) / total * 100) + "% done with download."),
 
-            # Deletes first header
-            del to_write[:top_chop]
+        on_complete = None
+        if self.__use_s3:
+            def on_complete(url, path):
+                try:
+                    s3.upload_file(bucket_name, directory + os.path.basename(path), path)
+                finally:
+                    os.remove(path)
+
+        downloader = self._make_downloader(where)
+        try:
+            report = downloader.download(jobs, progress, on_complete)
+        finally:
+            if self.__use_s3:
+                shutil.rmtree(where, ignore_errors=True)
+        if self.__use_s3:
+            report['skipped'] += [url for url, name in zip(urls, names) if directory + name in existing]
+        print("\nDownloaded: " + str(len(report['downloaded'])) + ", resumed: " + str(len(report['resumed'])) +
+              ", unchanged: " + str(len(report['unchanged']) + len(report['skipped'])) +
+              ", failed: " + str(len(report['failed'])))
+        return report
 
-            # Strips the lines
-            for idx, w in enumerate(to_write):
-                to_write[idx] = w.strip()
+    def _make_downloader(self, where):
+        """
+        Creates the Downloader for the download settings, with the download manifest when it is used.
 
-            # Redacted detection
-            for idx, w in enumerate(to_write):
-                for red_string in redacted_strings:
-                    if red_string in w:
-                        w = re.sub('  +', ' (This info has been redacted) ', w)
-                        w = re.sub(red_string, '', w)
-                        to_write[idx] = w
+        :param where: The local directory the PDFs are downloaded to.
+        :return: The Downloader.
+        """
+        manifest = None
+        if self.__use_download_manifest and not self.__use_s3:
+            manifest_file = self.__download_manifest
+            if manifest_file is None:
+                manifest_file = os.path.join(where, "download_manifest.json")
+            manifest = DownloadManifest(manifest_file)
+        return Downloader(workers=self.__download_workers, retries=self.__download_retries,
+                          backoff=self.__download_backoff, manifest=manifest, revalidate=self.__revalidate_downloads)
 
-            # Finally it writes to the new file
-            for w in to_write:
-                f.write(w + "\n")
+    def _fix_files(self, top_chop, header_size, footer_size, files=None, cache=None):
+        """
+        Fixes a file and makes it left aligned and removes header and footer.
 
+        :param top_chop: How many lines to remove at the top of the file.
+        :param header_size: How many lines to remove at the top of a page.
+        :param footer_size: How many lines to remove at the bottom of a page.
+        :param files: Optional list of the text files to fix. Default is every text file in convert_output_dir.
+        :param cache: Optional ConversionCache to record each fixed file in, once it is in place.
+        :return: None, fixes a file
+        """
         if self.__use_s3:
-            bucket_name = self.__convert_output_dir.split("/")[0]
-            bucket = self.__s3.get_bucket(bucket_name)
-            directory = self.__convert_output_dir[1:].join("/") + "/"
-            files = bucket.list(prefix=directory)
-            for file_name in files:
-                with open("temp/temp_fix.txt", "rw") as f:
-                    bucket.get_key(file_name).get_contents_to_file(f)
-                    fix(f)
-                    bucket.get_key(file_name).set_contents_from_file(f)
+            s3 = self._get_s3()
+            if files is None:
+                files = s3.list_keys(self.__convert_output_dir, ".txt")
+
+            def fix_s3_key(txt_key):
+                lines = s3.read(txt_key[0], txt_key[1]).splitlines(True)
+                s3.write(txt_key[0], txt_key[1],
+                         "".join(line + "\n" for line in fix_lines(lines, top_chop, header_size, footer_size,
+                                                                   self.__line_cleaner)))
+
+            for txt_key, result, error in s3.map(fix_s3_key, files):
+                if error is not None:
+                    print("\nCould not fix " + str(txt_key) + ": " + str(error))
         else:
-            for to_fix in glob.glob(os.path.join(self.__convert_output_dir, "*.txt")):
-                fix(to_fix)
+            if files is None:
+                files = glob.glob(os.path.join(self.__convert_output_dir, "*.txt"))
+            fix_key = self._fix_key()
+            try:
+                for to_fix in files:
+                    fix_file(to_fix, top_chop, header_size, footer_size, self.__line_cleaner)
+                    if cache is not None:
+                        cache.set_fixed(to_fix, fix_key)
+            finally:
+                if cache is not None:
+                    cache.save()
@@ -0,0 +1,277 @@
+"""
+email_index.py
+
+Keeps the fields of every parsed email in a SQLite database, so emails can be found by their fields without parsing
+the whole collection again.
+
+- EmailIndex: The SQLite index of the emails of a Collection.
+- email_rows: Gets the rows of the index for a document, can be run in the worker processes of Collection.imap.
+
+Run it to build an index, or to search one:
+
+    python email_index.py build emails.db your/dir/here/
+    python email_index.py find emails.db --from alice --has-attachments --sent-after 2010-06-01
+
+"""
+__author__ = 'alex'
+import argparse
+import re
+import sqlite3
+
+from dates import DATE_PARSER, to_timestamp
+from email_datatypes import Collection, LineSpan
+
+# The searchable fields, and the column each is kept in.
+_COLUMNS = [('from_', 'from_field'), ('to', 'to_field'), ('sent', 'sent'), ('subject', 'subject'), ('cc', 'cc'),
+            ('attachments', 'attachments')]
+
+_TABLE = """
+CREATE TABLE IF NOT EXISTS emails (
+    doc_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    from_field TEXT COLLATE NOCASE,
+    to_field TEXT COLLATE NOCASE,
+    sent TEXT COLLATE NOCASE,
+    subject TEXT COLLATE NOCASE,
+    cc TEXT COLLATE NOCASE,
+    attachments TEXT COLLATE NOCASE,
+    has_attachments INTEGER NOT NULL,
+    start_line INTEGER NOT NULL,
+    body_line INTEGER NOT NULL,
+    sent_timestamp INTEGER,
+    PRIMARY KEY (doc_id, position)
+);
+"""
+
+# The text fields are searched by word through a full text index, its docid is the rowid of the email.
+_TEXT_TABLE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS emails_text USING fts4(from_field, to_field, sent, subject, cc, attachments);
+"""
+
+# The text columns are searched through emails_text, so only the other columns are indexed.
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS emails_has_attachments ON emails (has_attachments);
+CREATE INDEX IF NOT EXISTS emails_sent_timestamp ON emails (sent_timestamp);
+"""
+
+# Adds emails to the full text index, with a WHERE clause to pick which.
+_FILL_TEXT = """
+INSERT INTO emails_text (docid, from_field, to_field, sent, subject, cc, attachments)
+SELECT rowid, from_field, to_field, sent, subject, cc, attachments FROM emails
+"""
+
+# The characters the full text index keeps in words, everything else splits words.
+_WORD = re.compile(r"[A-Za-z0-9\x80-\xff]+")
+
+
+def email_rows(document):
+    """
+    Gets the rows of the index for every email in a document.
+
+    :param document: The Document.
+    :return: A tuple of the document ID and the list of its rows.
+    """
+    rows = []
+    for position, email in enumerate(document):
+        raw = email.get_raw()
+        start_line = raw.get_start() if isinstance(raw, LineSpan) else 0
+        sent = email.get_sent_datetime()
+        rows.append((document.get_doc_id(), position, email.get_from(), email.get_to(), email.get_sent(),
+                     email.get_subject(), email.get_cc(), email.get_attachments(), int(email.has_attachments()),
+                     start_line, start_line + email.get_body_line(), None if sent is None else to_timestamp(sent)))
+    return document.get_doc_id(), rows
+
+
+class EmailIndex(object):
+    __index_file = None
+
+    def __init__(self, index_file):
+        """
+        An index of the fields of every email, with the document ID and position of each email in its document. Each row
+        also has the line the email starts on and the line its body starts on, in the document, and the sent date as
+        seconds since the epoch.
+
+        :param index_file: Where the SQLite database is, it is created if it does not exist.
+        :return: None
+        """
+        self.__index_file = index_file
+        self.__connection = sqlite3.connect(index_file)
+        # Fields are kept as the bytes they were parsed from.
+        self.__connection.text_factory = str
+        self.__connection.executescript(_TABLE)
+        self.__connection.executescript(_TEXT_TABLE)
+        self.__connection.executescript(_INDEXES)
+
+    def get_index_file(self):
+        """
+        Gets where the SQLite database is.
+
+        :return: The location of the index file.
+        """
+        return self.__index_file
+
+    def add_document(self, doc_id, rows):
+        """
+        Adds the emails of a document to the index, replacing any it already had.
+
+        :param doc_id: The ID of the document.
+        :param rows: The rows from email_rows.
+        :return: None
+        """
+        self.__connection.execute("DELETE FROM emails_text WHERE docid IN (SELECT rowid FROM emails WHERE doc_id = ?)",
+                                  (doc_id,))
+        self.__connection.execute("DELETE FROM emails WHERE doc_id = ?", (doc_id,))
+        self.__connection.executemany("INSERT INTO emails VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.__connection.execute(_FILL_TEXT + " WHERE doc_id = ?", (doc_id,))
+
+    def add_collection(self, collection, workers=None, commit_every=500):
+        """
+        Indexes every document of a collection.
+
+        :param collection: The Collection to index.
+        :param workers: Optional int, parse the documents in this many processes with Collection.imap.
+        :param commit_every: Int, how many documents to add before writing them to disk.
+        :return: The number of documents indexed.
+        """
+        if workers:
+            documents = collection.imap(email_rows, workers)
+        else:
+            documents = (email_rows(document) for document in collection)
+        count = 0
+        for doc_id, rows in documents:
+            self.add_document(doc_id, rows)
+            count += 1
+            if count % commit_every == 0:
+                self.__connection.commit()
+        self.__connection.commit()
+        return count
+
+    def find(self, from_=None, to=None, sent=None, subject=None, cc=None, attachments=None, has_attachments=None,
+             doc_id=None, limit=None, sent_after=None, sent_before=None):
+        """
+        Finds the emails that match every field given. Text fields are searched through the full text index, and match
+        if every word of the value is the start of a word in the field, ignoring case. Ex. from_="bob smi" matches
+        "Smith, Bob <bob@example.com>". A value without any letters or digits is searched for anywhere in the field,
+        which reads every row.
+
+        :param from_: Optional words in the from field.
+        :param to: Optional words in the to field.
+        :param sent: Optional words in the sent field.
+        :param subject: Optional words in the subject field.
+        :param cc: Optional words in the CC field.
+        :param attachments: Optional words in the attachments field.
+        :param has_attachments: Optional boolean, if the email has an attachments field.
+        :param doc_id: Optional ID of the document the emails are in.
+        :param limit: Optional int, the most rows to return.
+        :param sent_after: Optional datetime, only emails sent at or after it.
+        :param sent_before: Optional datetime, only emails sent before it.
+        :return: A list of (doc_id, position) tuples, ordered by document and position.
+        """
+        values = {'from_': from_, 'to': to, 'sent': sent, 'subject': subject, 'cc': cc, 'attachments': attachments}
+        where = []
+        args = []
+        terms = []
+        for name, column in _COLUMNS:
+            if values[name] is None:
+                continue
+            words = _WORD.findall(values[name])
+            if words:
+                terms += [column + ":" + word.lower() + "*" for word in words]
+            else:
+                where.append(column + " LIKE ? ESCAPE '\\'")
+                args.append("%" + values[name].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if terms:
+            where.append("rowid IN (SELECT docid FROM emails_text WHERE emails_text MATCH ?)")
+            args.append(" ".join(terms))
+        if has_attachments is not None:
+            where.append("has_attachments = ?")
+            args.append(int(has_attachments))
+        if doc_id is not None:
+            where.append("doc_id = ?")
+            args.append(doc_id)
+        if sent_after is not None:
+            where.append("sent_timestamp >= ?")
+            args.append(to_timestamp(sent_after))
+        if sent_before is not None:
+            where.append("sent_timestamp < ?")
+            args.append(to_timestamp(sent_before))
+        sql = "SELECT doc_id, position FROM emails"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY doc_id, position"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        return self.__connection.execute(sql, args).fetchall()
+
+    def get_sent_times(self):
+        """
+        Gets when every email was sent.
+
+        :return: A list of (doc_id, position, sent_timestamp) tuples, sent_timestamp is None if the date could not be parsed.
+        """
+        return self.__connection.execute("SELECT doc_id, position, sent_timestamp FROM emails").fetchall()
+
+    def get_row(self, doc_id, position):
+        """
+        Gets the indexed fields of an email.
+
+        :param doc_id: The ID of the document.
+        :param position: Int, the position of the email in the document.
+        :return: A dictionary of the columns of the email, None if it is not indexed.
+        """
+        cursor = self.__connection.execute("SELECT * FROM emails WHERE doc_id = ? AND position = ?", (doc_id, position))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def __len__(self):
+        return self.__connection.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+
+    def close(self):
+        """
+        Closes the database.
+
+        :return: None
+        """
+        self.__connection.close()
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Builds or searches an index of the emails in a collection.")
+    commands = parser.add_subparsers(dest="command")
+    build = commands.add_parser("build", help="Index every document in the directories.")
+    build.add_argument("index_file")
+    build.add_argument("directories", nargs="+")
+    build.add_argument("--file-type", default=".txt")
+    build.add_argument("--no-threads", action="store_true", help="Do not break emails up into threads.")
+    build.add_argument("--workers", type=int, default=None, help="Parse in this many processes.")
+    find = commands.add_parser("find", help="Print the emails that match every field given.")
+    find.add_argument("index_file")
+    for name, column in _COLUMNS:
+        find.add_argument("--" + name.rstrip("_"), dest=name)
+    find.add_argument("--has-attachments", action="store_true", default=None)
+    find.add_argument("--doc-id")
+    find.add_argument("--limit", type=int)
+    find.add_argument("--sent-after", help="A date, like 2010-06-01.")
+    find.add_argument("--sent-before", help="A date, like 2010-07-01.")
+    args = parser.parse_args()
+
+    index = EmailIndex(args.index_file)
+    if args.command == "build":
+        collection = Collection(args.directories, args.file_type)
+        collection.set_use_threads(not args.no_threads)
+        print str(index.add_collection(collection, args.workers)) + " documents indexed."
+    else:
+        sent_after = None if args.sent_after is None else DATE_PARSER.parse(args.sent_after)
+        sent_before = None if args.sent_before is None else DATE_PARSER.parse(args.sent_before)
+        for doc_id, position in index.find(args.from_, args.to, args.sent, args.subject, args.cc, args.attachments,
+                                           args.has_attachments, args.doc_id, args.limit, sent_after, sent_before):
+            row = index.get_row(doc_id, position)
+            print "\t".join([doc_id, str(position), row['from_field'], row['sent'], row['subject']])
+    index.close()
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,91 @@
+"""
+headers.py
+
+Decides which header field, if any, the first word of a line of an email belongs to, without comparing every word of
+every email against every field.
+
+- HeaderClassifier: Matches words to header fields with a lookup table, only fuzzy matching words it has not seen.
+- HEADER_FIELDS: The header fields of an email.
+- OCR_VARIANTS: Words that are commonly OCR'd in place of the header fields.
+- HEADER_CLASSIFIER: The classifier used when parsing emails.
+
+"""
+__author__ = 'alex'
+from fuzzywuzzy import fuzz
+
+HEADER_FIELDS = ['From', 'To', 'Sent', 'Subject', 'CC', 'Attachments']
+
+# Common OCR'ing mistakes of the header fields, and the other names they go by.
+OCR_VARIANTS = ['Prom', 'Frorn', 'Fron', 'Tc', 'T0', 'Sant', '5ent', 'Sont', 'Semt', 'Date', 'Subj', 'Subiect',
+                'Sublect', '5ubject', 'Cc', 'Ce', 'Bcc', 'Attachment', 'Attachrnents']
+
+
+class HeaderClassifier(object):
+    __fields = []
+    __min_ratio = 50
+    __max_size = 100000
+
+    def __init__(self, fields=None, variants=None, min_ratio=50, max_size=100000):
+        """
+        Matches a word to every field it is similar enough to, the same as comparing it to each field with fuzz.ratio.
+        A word is only compared once, the answer is kept in a table that starts with the fields and their common OCR
+        variants. Only fields a word could possibly match are compared, a word must be less than three times as long as
+        a field, and a field less than three times as long as the word, for their ratio to be over 50.
+
+        :param fields: A list of the field names. Default is HEADER_FIELDS.
+        :param variants: A list of words to put in the table up front. Default is OCR_VARIANTS.
+        :param min_ratio: Int, a word matches a field if their fuzz.ratio is over this. At least 50.
+        :param max_size: Int, how many words the table can hold before it is emptied, to bound its memory.
+        :return: None
+        """
+        if fields is None:
+            fields = HEADER_FIELDS
+        if variants is None:
+            variants = OCR_VARIANTS
+        self.__fields = [(field, field.lower()) for field in fields]
+        self.__min_ratio = max(50, min_ratio)
+        self.__max_size = max(1, max_size)
+        self.__known = {}
+        self.__seed = {}
+        for word in fields + variants:
+            self.__seed[word.lower()] = self._compare(word.lower())
+        self.__known.update(self.__seed)
+
+    def get_fields(self):
+        """
+        Gets the field names.
+
+        :return: The list of field names.
+        """
+        return [field for field, lower in self.__fields]
+
+    def classify(self, word):
+        """
+        Gets the fields a word matches.
+
+        :param word: The word to match, usually the first word of a line.
+        :return: A tuple of the field names the word matches, empty if it is not a header.
+        """
+        lower = word.lower()
+        fields = self.__known.get(lower)
+        if fields is None:
+            fields = self._compare(lower)
+            if len(self.__known) >= self.__max_size:
+                self.__known = dict(self.__seed)
+            self.__known[lower] = fields
+        return fields
+
+    def _compare(self, lower):
+        """
+        Fuzzy matches a lowercase word against the fields it is close enough in length to match.
+
+        :param lower: The lowercase word.
+        :return: A tuple of the field names the word matches.
+        """
+        size = len(lower)
+        return tuple(field for field, field_lower in self.__fields
+                     if size < 3 * len(field_lower) and len(field_lower) < 3 * size and
+                     fuzz.ratio(field_lower, lower) > self.__min_ratio)
+
+
+HEADER_CLASSIFIER = HeaderClassifier()
@@ -0,0 +1,174 @@
+"""
+pipeline.py
+
+Runs items through a chain of stages, each with its own worker threads, so an item moves on as soon as its last stage
+is done with it instead of waiting for every other item.
+
+- Pipeline: A chain of stages joined by bounded queues.
+
+"""
+__author__ = 'alex'
+import threading
+from Queue import Queue, Empty, Full
+
+# Put on a queue to tell a worker there is nothing more coming.
+_DONE = object()
+# How often a thread waiting on a queue checks if the run was stopped, in seconds.
+_POLL = 0.1
+
+
+def _put(queue, item, stop):
+    """
+    Puts an item on a queue, waiting while it is full unless the run is stopped.
+
+    :param queue: The queue.
+    :param item: The item to put on it.
+    :param stop: The threading.Event set when the run is stopped.
+    :return: Boolean, True if the item was put on the queue, False if the run was stopped first.
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=_POLL)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _get(queue, stop):
+    """
+    Takes an item from a queue, waiting while it is empty unless the run is stopped.
+
+    :param queue: The queue.
+    :param stop: The threading.Event set when the run is stopped.
+    :return: The item, _DONE if the run was stopped first.
+    """
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=_POLL)
+        except Empty:
+            pass
+    return _DONE
+
+
+class Pipeline(object):
+    __queue_size = 16
+
+    def __init__(self, queue_size=16):
+        """
+        A chain of stages. Every stage has its own worker threads and is joined to the next by a queue that holds at
+        most queue_size items, so a fast stage waits for a slow one instead of piling up work in memory.
+
+        :param queue_size: Int, how many items can wait between two stages.
+        :return: None
+        """
+        self.__queue_size = max(1, queue_size)
+        self.__stages = []
+        self.__errors = []
+        self.__lock = threading.Lock()
+
+    def add_stage(self, name, function, workers=1, finish=None):
+        """
+        Adds a stage to the end of the chain.
+
+        :param name: The name of the stage, used when reporting errors.
+        :param function: Called with each item, returns the item for the next stage, or None to drop it.
+        :param workers: Int, how many threads run this stage.
+        :param finish: Optional function each worker thread calls when the stage is done, such as closing connections.
+        :return: None
+        """
+        self.__stages.append((name, function, max(1, workers), finish))
+
+    def get_errors(self):
+        """
+        Gets the errors raised by the stages. An item that raised is dropped and the rest keep going.
+
+        :return: A list of (stage name, item, error) tuples.
+        """
+        with self.__lock:
+            return self.__errors[:]
+
+    def run(self, items):
+        """
+        Starts every stage and feeds it the items. If the generator is closed before it is done, by a break, an
+        exception, or close(), every thread stops taking new items, and the generator waits for the items being worked
+        on to finish so nothing is left running.
+
+        :param items: An iterable of items for the first stage.
+        :return: A generator of what the last stage returns, in the order the items finish.
+        """
+        queues = [Queue(self.__queue_size) for _ in xrange(len(self.__stages) + 1)]
+        stop = threading.Event()
+
+        def feed():
+            for item in items:
+                if not _put(queues[0], item, stop):
+                    return
+            for _ in xrange(self.__stages[0][2]):
+                _put(queues[0], _DONE, stop)
+
+        threads = [threading.Thread(target=feed)]
+        for idx, (name, function, workers, finish) in enumerate(self.__stages):
+            if idx + 1 < len(self.__stages):
+                downstream = self.__stages[idx + 1][2]
+            else:
+                downstream = 1
+            threads += self._start_stage(name, function, workers, finish, queues[idx], queues[idx + 1], downstream,
+                                         stop)
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _start_stage(self, name, function, workers, finish, in_queue, out_queue, downstream, stop):
+        """
+        Creates the worker threads of a stage, and one more that tells the next stage when they are all done.
+
+        :param name: The name of the stage.
+        :param function: The function to run on each item.
+        :param workers: How many worker threads to create.
+        :param finish: Optional function each worker calls when it is done.
+        :param in_queue: The queue to take items from.
+        :param out_queue: The queue to put results on.
+        :param downstream: How many workers the next stage has, one _DONE is sent for each.
+        :param stop: The threading.Event set when the run is stopped, the workers return once it is.
+        :return: The list of threads, not started.
+        """
+
+        def work():
+            try:
+                while True:
+                    item = _get(in_queue, stop)
+                    if item is _DONE:
+                        return
+                    try:
+                        result = function(item)
+                    except Exception as e:
+                        with self.__lock:
+                            self.__errors.append((name, item, e))
+                        continue
+                    if result is not None and not _put(out_queue, result, stop):
+                        return
+            finally:
+                if finish is not None:
+                    finish()
+
+        worker_threads = [threading.Thread(target=work) for _ in xrange(workers)]
+
+        def close():
+            for thread in worker_threads:
+                thread.join()
+            for _ in xrange(downstream):
+                _put(out_queue, _DONE, stop)
+
+        return worker_threads + [threading.Thread(target=close)]
@@ -7,15 +7,21 @@ Contains the classes for all of the profile disambiguation and classes assosiate
 - ProfileStorage: Container object that handles the creation of profiles and disambiguation.
 - Profile: The actual profile class, contains the average creation methods, as well as storage and accessor methods.
 - Contact: Feed this an input string and it will parse the contact.
+- ContactCache: Parses each distinct contact string once, and gives back the same frozen Contact after that.
+- CONTACT_CACHE: The cache used when pulling contacts from a collection and making profiles.
 - Name: What is returned when you call Contact.get_name(), has getter methods for first, middle, and last.
 - EmailAddress: What is returned when you call Contact.get_email(), has getter methods for user and domain.
 
 """
 __author__ = 'alex'
+import copy
 import re
 from fuzzywuzzy import fuzz
+from cleaning import OCR_CLEANER
 import pickle
+import threading
 import time
+from collections import OrderedDict
 
 
 class ProfileStorage(object):
@@ -383,7 +389,7 @@ class Profile(object):
                     if email.index(email_part) == 0:
                         name_str += "@"
         name_str = name_str.strip()
-        self.__average_contact = Contact(name_str, "")
+        self.__average_contact = CONTACT_CACHE.get(name_str, "")
 
     def get_average_contact(self):
         """
@@ -420,6 +426,7 @@ class EmailAddress(object):
     __domain = None
     __user = None
     __redacted = None
+    __frozen = False
 
     def __init__(self, email_str):
         """
@@ -447,8 +454,24 @@ class EmailAddress(object):
         :param redacted: The Boolean to set.
         :return: None.
         """
+        if self.__frozen:
+            raise TypeError("This email address is shared by a ContactCache and can not be changed.")
         self.__redacted = redacted
 
+    def _freeze(self):
+        """
+        Stops the email address from being changed, called when its contact is frozen.
+
+        :return: None.
+        """
+        self.__frozen = True
+
+    def __getstate__(self):
+        # An unpickled or copied email address is not shared by a ContactCache.
+        state = self.__dict__.copy()
+        state.pop('_EmailAddress__frozen', None)
+        return state
+
     def get_redacted(self):
         """
         Gets the redacted state of the email object.
@@ -510,6 +533,7 @@ class Name:
     __middle_init = ""
     __redacted = False
     __redacted_str = ""
+    __frozen = False
 
     def __init__(self, name_str, redacted_str):
         """
@@ -574,8 +598,24 @@ class Name:
         :param redacted: Boolean to set if the name has been redacted.
         :return: None.
         """
+        if self.__frozen:
+            raise TypeError("This name is shared by a ContactCache and can not be changed.")
         self.__redacted = redacted
 
+    def _freeze(self):
+        """
+        Stops the name from being changed, called when its contact is frozen.
+
+        :return: None.
+        """
+        self.__frozen = True
+
+    def __getstate__(self):
+        # An unpickled or copied name is not shared by a ContactCache.
+        state = self.__dict__.copy()
+        state.pop('_Name__frozen', None)
+        return state
+
     def get_redacted(self):
         """
         Gets the redacted state of the name object.
@@ -635,6 +675,8 @@ class Contact(object):
     __has_email = True
     __has_name = True
     __sanitize = True
+    __frozen = False
+    __regex_email_pattern = re.compile(r'[\w\.-]+@[\w\.-]+', re.UNICODE)
 
     def __init__(self, raw_string, redacted_string):
         """
@@ -649,7 +691,6 @@ class Contact(object):
         :param redacted_string: The string to show if an item has been redacted.
         :return: None.
         """
-        self.__regex_email_pattern = re.compile(r'[\w\.-]+@[\w\.-]+', re.UNICODE)
         self.__raw_string = raw_string
         self.__redacted_string = redacted_string
         self._run()
@@ -707,8 +748,36 @@ class Contact(object):
         :return: None.
         :rtype: None
         """
+        if self.__frozen:
+            raise TypeError("This contact is shared by a ContactCache and can not be changed.")
         self.__sanitize = sanitize
 
+    def is_frozen(self):
+        """
+        Checks if the contact is shared by a ContactCache, and so can not be changed. Its name and email address can
+        not be changed either.
+
+        :return: Boolean. True if it is frozen, False if not.
+        """
+        return self.__frozen
+
+    def _freeze(self):
+        """
+        Stops the contact, its name, and its email address from being changed, called by ContactCache before it is
+        shared.
+
+        :return: None.
+        """
+        self.__name._freeze()
+        self.__email_address._freeze()
+        self.__frozen = True
+
+    def __getstate__(self):
+        # An unpickled or copied contact, such as one in a pickled ProfileStorage, is not shared by a ContactCache.
+        state = self.__dict__.copy()
+        state.pop('_Contact__frozen', None)
+        return state
+
     def get_sanitize(self):
         """
         Gets the current sanitation state.
@@ -772,17 +841,15 @@ class Contact(object):
         """
         raw = self.__raw_string
         # sanitize the input from common ocr'ing mistakes
-        raw = raw.replace("›", ">")
-        raw = raw.replace("‹", "<")
-        raw = raw.replace("©", "@")
-        # raw = raw.replace("", "")
+        raw = OCR_CLEANER.clean(raw)
         # identify email address
         try:
             email_address = re.search(self.__regex_email_pattern, raw)
             self.__email_address = EmailAddress(email_address.group(0).strip())
         except AttributeError:
-            # No email found
+            # No email found, the contact gets its own empty address so marking it redacted does not change others.
             self.__has_email = False
+            self.__email_address = copy.copy(self.__email_address)
             if self.__redacted_string in raw:
                 self.__email_address.set_redacted(True)
         # Identify name
@@ -794,9 +861,86 @@ class Contact(object):
             self.__name = Name(name.strip(), self.__redacted_string)
         else:
             self.__has_name = False
+            self.__name = copy.copy(self.__name)
             self.__name.set_redacted(True)
 
 
+class ContactCache(object):
+    __max_size = 100000
+
+    def __init__(self, max_size=100000):
+        """
+        Parses each distinct contact string once. The same address is in thousands of emails, so after the first time a
+        string is parsed, the same Contact is given back, frozen so it can be shared. The least recently used strings
+        are dropped when the cache is full.
+
+        :param max_size: Int, how many contacts to keep.
+        :return: None.
+        """
+        self.__max_size = max(1, max_size)
+        self.__contacts = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = threading.Lock()
+
+    def get(self, raw_string, redacted_string):
+        """
+        Gets the parsed contact of a string, parsing it if it is not in the cache.
+
+        :param raw_string: The raw string that represents the field. See Contact.
+        :param redacted_string: The string to show if an item has been redacted.
+        :return: The frozen Contact.
+        """
+        key = (raw_string, redacted_string)
+        with self.__lock:
+            contact = self.__contacts.pop(key, None)
+            if contact is not None:
+                self.__hits += 1
+                self.__contacts[key] = contact
+                return contact
+            self.__misses += 1
+        contact = Contact(raw_string, redacted_string)
+        contact._freeze()
+        with self.__lock:
+            self.__contacts[key] = contact
+            while len(self.__contacts) > self.__max_size:
+                self.__contacts.popitem(last=False)
+        return contact
+
+    def get_hits(self):
+        """
+        Gets how many times a contact was found in the cache.
+
+        :return: Int, the number of hits.
+        """
+        return self.__hits
+
+    def get_misses(self):
+        """
+        Gets how many times a contact had to be parsed.
+
+        :return: Int, the number of misses.
+        """
+        return self.__misses
+
+    def clear(self):
+        """
+        Empties the cache and resets the hits and misses.
+
+        :return: None.
+        """
+        with self.__lock:
+            self.__contacts = OrderedDict()
+            self.__hits = 0
+            self.__misses = 0
+
+    def __len__(self):
+        return len(self.__contacts)
+
+
+CONTACT_CACHE = ContactCache()
+
+
 class EmptyCollectionException(Exception):
     pass
 
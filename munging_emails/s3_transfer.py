@@ -0,0 +1,301 @@
+"""
+s3_transfer.py
+
+Moves objects in and out of Amazon S3 through memory, working on several keys at the same time.
+
+- S3Transfer: Lists, reads, and writes keys, uploading large objects in concurrent parts and reading keys ahead.
+- split_location: Breaks a location like "mybucket/emails/text/" into its bucket and directory.
+- connect_s3: Connects to S3, or to a local stand-in for S3 when given a host.
+
+"""
+__author__ = 'alex'
+import threading
+from cStringIO import StringIO
+from Queue import Queue, Empty
+
+import boto
+from boto.s3.connection import OrdinaryCallingFormat
+
+
+def split_location(location):
+    """
+    Breaks an S3 location into its bucket and directory.
+
+    :param location: A string like "mybucket/emails/text/".
+    :return: A tuple of the bucket name and the directory, like ("mybucket", "emails/text/").
+    """
+    parts = location.split("/")
+    return parts[0], "/".join(parts[1:])
+
+
+def connect_s3(host=None, port=None, is_secure=True):
+    """
+    Connects to S3. Give a host and port to connect to a local stand-in for S3 instead, like moto_server.
+
+    :param host: Optional host to connect to instead of Amazon's.
+    :param port: Optional port to connect to.
+    :param is_secure: Boolean, False to use http instead of https.
+    :return: The S3 connection.
+    """
+    if host is None:
+        return boto.connect_s3()
+    return boto.connect_s3(host=host, port=port, is_secure=is_secure, calling_format=OrdinaryCallingFormat())
+
+
+class S3Transfer(object):
+    __workers = 4
+    __multipart_threshold = 16 * 1024 * 1024
+    __part_size = 8 * 1024 * 1024
+
+    def __init__(self, connection=None, workers=4, multipart_threshold=16 * 1024 * 1024, part_size=8 * 1024 * 1024):
+        """
+        Reads and writes S3 objects in memory, without temporary files.
+
+        :param connection: The S3 connection to use. Default is connect_s3().
+        :param workers: Int, how many keys, or parts of a key, to transfer at the same time.
+        :param multipart_threshold: Int, objects with at least this many bytes are uploaded in parts.
+        :param part_size: Int, the size in bytes of each part of a multipart upload, at least 5MB for Amazon.
+        :return: None
+        """
+        if connection is None:
+            connection = connect_s3()
+        self.__connection = connection
+        self.__workers = max(1, workers)
+        self.__multipart_threshold = multipart_threshold
+        self.__part_size = part_size
+        self.__buckets = {}
+        self.__lock = threading.Lock()
+
+    def get_connection(self):
+        """
+        Gets the S3 connection.
+
+        :return: The S3 connection.
+        """
+        return self.__connection
+
+    def get_workers(self):
+        """
+        Gets how many keys are transferred at the same time.
+
+        :return: The number of workers.
+        """
+        return self.__workers
+
+    def get_bucket(self, bucket_name):
+        """
+        Gets a bucket, only looking it up once.
+
+        :param bucket_name: The name of the bucket.
+        :return: The bucket.
+        """
+        with self.__lock:
+            if bucket_name not in self.__buckets:
+                self.__buckets[bucket_name] = self.__connection.get_bucket(bucket_name)
+            return self.__buckets[bucket_name]
+
+    def list_keys(self, location, suffix=""):
+        """
+        Lists the names of the keys in an S3 location.
+
+        :param location: A string like "mybucket/emails/text/".
+        :param suffix: Only list keys ending with this. Ex. ".txt".
+        :return: A list of (bucket_name, key_name) tuples.
+        """
+        bucket_name, directory = split_location(location)
+        return [(bucket_name, key.name) for key in self.get_bucket(bucket_name).list(prefix=directory)
+                if key.name.endswith(suffix) and not key.name.endswith("/")]
+
+    def read(self, bucket_name, key_name):
+        """
+        Reads a key into memory.
+
+        :param bucket_name: The name of the bucket.
+        :param key_name: The name of the key.
+        :return: The contents of the key.
+        :rtype: str
+        """
+        return self.get_bucket(bucket_name).get_key(key_name).get_contents_as_string()
+
+    def write(self, bucket_name, key_name, data):
+        """
+        Writes data to a key, in concurrent parts if it is large.
+
+        :param bucket_name: The name of the bucket.
+        :param key_name: The name of the key.
+        :param data: The string to write.
+        :return: None
+        """
+        bucket = self.get_bucket(bucket_name)
+        if len(data) < self.__multipart_threshold:
+            bucket.new_key(key_name).set_contents_from_string(data)
+            return
+        parts = [data[start:start + self.__part_size] for start in xrange(0, len(data), self.__part_size)]
+        self._write_parts(bucket, key_name, parts)
+
+    def upload_file(self, bucket_name, key_name, path):
+        """
+        Uploads a file to a key, in concurrent parts if it is large.
+
+        :param bucket_name: The name of the bucket.
+        :param key_name: The name of the key.
+        :param path: The file to upload.
+        :return: None
+        """
+        with open(path, "rb") as f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(0)
+            if size < self.__multipart_threshold:
+                self.get_bucket(bucket_name).new_key(key_name).set_contents_from_file(f)
+                return
+        lock = threading.Lock()
+        handle = open(path, "rb")
+
+        def read_part(number):
+            with lock:
+                handle.seek(number * self.__part_size)
+                return handle.read(self.__part_size)
+
+        try:
+            count = (size + self.__part_size - 1) // self.__part_size
+            self._write_parts(self.get_bucket(bucket_name), key_name, xrange(count), read_part)
+        finally:
+            handle.close()
+
+    def prefetch(self, keys, read_ahead=4, max_bytes=64 * 1024 * 1024):
+        """
+        Reads keys in order, with the next few downloading in the background while the current one is worked on.
+
+        :param keys: An iterable of (bucket_name, key_name) tuples.
+        :param read_ahead: Int, how many keys past the current one can be downloading or waiting in memory.
+        :param max_bytes: Int, no more keys start downloading while the keys waiting in memory, and those still downloading at the average size read so far, add up to this many bytes. The next key is always read, however large it is.
+        :return: A generator of ((bucket_name, key_name), contents) tuples, in the order of keys. An error reading a key is raised when its turn comes.
+        """
+        keys = list(keys)
+        read_ahead = max(1, read_ahead)
+        cond = threading.Condition()
+        results = {}
+        # The next key to download, the next key to give back, the bytes waiting in memory, and the bytes read so far.
+        state = {'next_start': 0, 'next_yield': 0, 'waiting_bytes': 0, 'read_bytes': 0, 'read_keys': 0, 'stop': False}
+
+        def can_start():
+            ahead = state['next_start'] - state['next_yield']
+            if ahead == 0:
+                return True
+            downloading = ahead - len(results)
+            average = state['read_bytes'] / max(1, state['read_keys'])
+            return ahead < read_ahead and state['waiting_bytes'] + downloading * average < max_bytes
+
+        def work():
+            while True:
+                with cond:
+                    while not state['stop'] and state['next_start'] < len(keys) and not can_start():
+                        cond.wait()
+                    if state['stop'] or state['next_start'] >= len(keys):
+                        return
+                    idx = state['next_start']
+                    state['next_start'] += 1
+                data = None
+                error = None
+                try:
+                    data = self.read(*keys[idx])
+                except Exception as e:
+                    error = e
+                with cond:
+                    results[idx] = (data, error)
+                    if data is not None:
+                        state['waiting_bytes'] += len(data)
+                        state['read_bytes'] += len(data)
+                        state['read_keys'] += 1
+                    cond.notify_all()
+
+        threads = [threading.Thread(target=work) for _ in xrange(min(read_ahead, len(keys)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for idx, key in enumerate(keys):
+                with cond:
+                    while idx not in results:
+                        cond.wait()
+                    data, error = results.pop(idx)
+                    if data is not None:
+                        state['waiting_bytes'] -= len(data)
+                    state['next_yield'] = idx + 1
+                    cond.notify_all()
+                if error is not None:
+                    raise error
+                yield key, data
+        finally:
+            with cond:
+                state['stop'] = True
+                cond.notify_all()
+            # Downloads already started are finished, so no thread is left running.
+            for thread in threads:
+                thread.join()
+
+    def map(self, function, items):
+        """
+        Runs a function on every item, workers at a time. Use it to work on several keys at once.
+
+        :param function: The function to run on each item.
+        :param items: The list of items.
+        :return: A list of (item, result, error) tuples, in the order they finished. error is None if it worked.
+        """
+        results = []
+        lock = threading.Lock()
+        queue = Queue()
+        for item in items:
+            queue.put(item)
+
+        def work():
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except Empty:
+                    return
+                result = None
+                error = None
+                try:
+                    result = function(item)
+                except Exception as e:
+                    error = e
+                with lock:
+                    results.append((item, result, error))
+
+        threads = [threading.Thread(target=work) for _ in xrange(min(self.__workers, len(items)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _write_parts(self, bucket, key_name, parts, read_part=None):
+        """
+        Uploads a key as a multipart upload, sending workers parts at the same time.
+
+        :param bucket: The bucket.
+        :param key_name: The name of the key.
+        :param parts: The list of parts, or of part numbers if read_part is given.
+        :param read_part: Optional function that takes a part number and returns the data of that part.
+        :return: None
+        """
+        upload = bucket.initiate_multipart_upload(key_name)
+
+        def send(numbered):
+            number, part = numbered
+            if read_part is not None:
+                part = read_part(part)
+            # Part numbers start at 1.
+            upload.upload_part_from_file(StringIO(part), number + 1)
+
+        try:
+            for numbered, result, error in self.map(send, list(enumerate(parts))):
+                if error is not None:
+                    raise error
+            upload.complete_upload()
+        except Exception:
+            upload.cancel_upload()
+            raise
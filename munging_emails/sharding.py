@@ -0,0 +1,98 @@
+"""
+sharding.py
+
+Splits a collection up between machines without them talking to each other, and combines what each machine made.
+
+- shard_of: Gets the shard a document belongs to, the same on every machine.
+- save_shard_output: Writes what a shard made to a file.
+- load_shard_output: Reads what a shard made from a file.
+- merge_outputs: Combines what the shards made into one output.
+- merge_shard_files: Combines the files the shards wrote into one output.
+
+"""
+__author__ = 'alex'
+import cPickle
+import numbers
+import zlib
+
+
+def shard_of(doc_id, num_shards):
+    """
+    Gets the shard a document belongs to, from a hash of its ID that is the same on every machine and every run.
+
+    :param doc_id: The ID of the document.
+    :param num_shards: Int, how many shards the documents are split into.
+    :return: Int, the shard of the document, from 0 to num_shards - 1.
+    """
+    if isinstance(doc_id, unicode):
+        doc_id = doc_id.encode("utf-8")
+    return (zlib.crc32(doc_id) & 0xffffffff) % num_shards
+
+
+def save_shard_output(path, output):
+    """
+    Writes what a shard made to a file, such as the list of contacts from Collection.pull_contacts.
+
+    :param path: Where to write it.
+    :param output: What the shard made, anything that can be pickled.
+    :return: None
+    """
+    with open(path, "wb") as f:
+        cPickle.dump(output, f, 2)
+
+
+def load_shard_output(path):
+    """
+    Reads what a shard made from a file written by save_shard_output.
+
+    :param path: Where it was written.
+    :return: What the shard made.
+    """
+    with open(path, "rb") as f:
+        return cPickle.load(f)
+
+
+def merge_outputs(outputs):
+    """
+    Combines what the shards made. Lists are joined in the order of the shards, sets are unioned, and dictionaries are
+    merged, combining the values of keys more than one shard has the same way, and adding numbers.
+
+    :param outputs: A list of what each shard made, all of the same type.
+    :return: The combined output.
+    """
+    merged = None
+    for output in outputs:
+        merged = output if merged is None else _combine(merged, output)
+    return merged
+
+
+def merge_shard_files(paths):
+    """
+    Combines the files written by save_shard_output on each shard.
+
+    :param paths: The list of files, one for each shard.
+    :return: The combined output. See merge_outputs.
+    """
+    return merge_outputs(load_shard_output(path) for path in paths)
+
+
+def _combine(first, second):
+    """
+    Combines two outputs.
+
+    :param first: The output of one shard.
+    :param second: The output of the next shard.
+    :return: The combined output.
+    """
+    if isinstance(first, (list, tuple)) and isinstance(second, (list, tuple)):
+        return list(first) + list(second)
+    if isinstance(first, (set, frozenset)) and isinstance(second, (set, frozenset)):
+        return set(first) | set(second)
+    if isinstance(first, dict) and isinstance(second, dict):
+        merged = dict(first)
+        for key, value in second.iteritems():
+            merged[key] = _combine(merged[key], value) if key in merged else value
+        return merged
+    if isinstance(first, numbers.Number) and isinstance(second, numbers.Number):
+        return first + second
+    raise TypeError("Can not merge " + type(first).__name__ + " with " + type(second).__name__)